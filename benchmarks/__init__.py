@@ -0,0 +1,7 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2021 nickofolas
+"""
+Reproducible benchmarks for neo phoenix's hot paths
+
+Benchmarks run against stubbed Discord objects, and never connect to Discord
+"""
@@ -0,0 +1,266 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2021 nickofolas
+"""
+Benchmarks `Highlights.listen_for_highlights` against synthetic workloads
+
+Each case runs in a fresh process, so that peak memory is measured per case.
+Run from the repository root:
+
+    python -m benchmarks.highlight --triggers 1000 10000 --sizes 64 512
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import count
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+TRIGGERS_PER_USER = 10
+WORD_CHANCE = 0.02  # Chance that a given word in a message is a trigger
+GUILD_COUNT = 10
+CHANNELS_PER_GUILD = 10
+
+
+def make_word(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+
+
+class StubHistory:
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def flatten(self):
+        return self.messages
+
+
+class StubMember:
+    def __init__(self, id: int):
+        self.id = id
+        self.bot = False
+        self._roles = ()
+        self.display_name = f"user{id}"
+        self.default_avatar = SimpleNamespace(key=str(id % 5))
+
+    def __str__(self):
+        return self.display_name
+
+
+class StubGuild:
+    def __init__(self, id: int):
+        self.id = id
+        self.name = f"guild{id}"
+        self.members: dict[int, StubMember] = {}
+
+    async def fetch_member(self, member_id: int, *, cache=False):
+        return self.members.setdefault(member_id, StubMember(member_id))
+
+    def get_member(self, member_id: int):
+        return self.members.get(member_id)
+
+
+class StubChannel:
+    def __init__(self, id: int, guild: StubGuild):
+        self.id = id
+        self.name = f"channel{id}"
+        self.guild = guild
+
+    def permissions_for(self, member):
+        return SimpleNamespace(read_messages=True, view_channel=True)
+
+    def history(self, *, limit, around):
+        return StubHistory([around])
+
+
+class StubMessage:
+    def __init__(self, id: int, content: str, channel: StubChannel, author: StubMember):
+        self.id = id
+        self.content = content
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.mentions = []
+        self.attachments = self.embeds = self.stickers = []
+        self.jump_url = f"https://discord.com/channels/{self.guild.id}/{channel.id}/{id}"
+        self.created_at = datetime.now(timezone.utc)
+
+
+class StubDB:
+    def __init__(self, records):
+        self.records = records
+
+    async def fetch(self, query, *args):
+        return self.records
+
+
+class StubUser:
+    async def send(self, *args, **kwargs):
+        pass
+
+
+class StubBot:
+    def __init__(self, *, cfg: dict, user_ids: list[int], records: list[dict]):
+        self.cfg = cfg
+        self.loop = asyncio.get_running_loop()
+        self.db = StubDB(records)
+        self.profiles = {
+            user_id: SimpleNamespace(
+                user_id=user_id,
+                hl_blocks=[],
+                receive_highlights=True,
+                hl_timeout=1
+            ) for user_id in user_ids
+        }
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_user(self, id, *, as_partial=False):
+        return StubUser()
+
+
+def generate_workload(*, triggers: int, size: int, messages: int, seed: int):
+    rng = random.Random(seed)
+    # Triggers are drawn from a smaller pool of words, so that popular
+    # triggers are shared between users, as they are in practice
+    trigger_words = [make_word(rng) for _ in range(max(triggers // 2, 1))]
+    filler_words = [make_word(rng) for _ in range(5000)]
+
+    user_ids = [*range(1, triggers // TRIGGERS_PER_USER + 2)]
+    records, seen = [], set()
+    for index in range(triggers):
+        user_id = user_ids[index // TRIGGERS_PER_USER]
+        if (user_id, word := rng.choice(trigger_words)) not in seen:
+            seen.add((user_id, word))
+            records.append({"user_id": user_id, "content": word})
+
+    guilds = [StubGuild(guild_id) for guild_id in range(1, GUILD_COUNT + 1)]
+    channels = [
+        StubChannel(guild.id * 1000 + index, guild)
+        for guild in guilds for index in range(CHANNELS_PER_GUILD)
+    ]
+    authors = [StubMember(10 ** 9 + index) for index in range(100)]
+
+    message_ids = count(10 ** 12)
+    stream = []
+    for _ in range(messages):
+        words = []
+        while sum(map(len, words)) + len(words) < size:
+            pool = trigger_words if rng.random() < WORD_CHANCE else filler_words
+            words.append(rng.choice(pool))
+        stream.append(StubMessage(
+            next(message_ids),
+            " ".join(words)[:size],
+            rng.choice(channels),
+            rng.choice(authors)
+        ))
+    return user_ids, records, stream
+
+
+async def run_case(*, triggers: int, size: int, messages: int, workers: int, seed: int):
+    from neo import runtime
+    runtime.patch_all()  # The addon's commands rely on the patched commands.Group
+    from neo.addons.highlight import Highlights
+
+    user_ids, records, stream = generate_workload(
+        triggers=triggers, size=size, messages=messages, seed=seed)
+    bot = StubBot(
+        # Delivery is held off so that only matching is measured
+        cfg={"highlights": {"matcher_workers": workers, "delivery_delay": 3600}},
+        user_ids=user_ids,
+        records=records
+    )
+
+    start = time.perf_counter()
+    addon = Highlights(bot)
+    # Await the initialization scheduled by the addon, rather than running another
+    await next(
+        task for task in asyncio.all_tasks()
+        if task.get_coro().__qualname__ == "Highlights.__ainit__"
+    )
+    await addon.matcher.search("")  # Wait for any matcher workers to come up
+    setup_time = time.perf_counter() - start
+
+    latencies = []
+    for message in stream:
+        start = time.perf_counter()
+        await addon.listen_for_highlights(message)
+        latencies.append(time.perf_counter() - start)
+        addon.queued_highlights.clear()
+
+    addon.cog_unload()
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "triggers": len(records),
+        "size": size,
+        "setup": setup_time,
+        "throughput": len(latencies) / total if total else float("inf"),
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)],
+        "peak_memory": (
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            if resource else None
+        )
+    }
+
+
+def run_case_sync(kwargs: dict) -> dict:
+    return asyncio.run(run_case(**kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--triggers", type=int, nargs="+",
+                        default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512, 2000],
+                        help="Message sizes, in characters")
+    parser.add_argument("--messages", type=int, default=2000,
+                        help="Messages sent per case")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Value for highlights.matcher_workers")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from neo.types.formatters import Table
+
+    table = Table()
+    table.init_columns("Triggers", "Size", "Setup (s)", "Msgs/s", "p50 (ms)", "p99 (ms)", "Peak RSS (MiB)")
+    context = multiprocessing.get_context("spawn")
+
+    for triggers in args.triggers:
+        for size in args.sizes:
+            # A fresh process per case. Unlike `multiprocessing.Pool`, the executor's
+            # processes aren't daemonic, so they can spawn matcher workers.
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                result = executor.submit(run_case_sync, {
+                    "triggers": triggers,
+                    "size": size,
+                    "messages": args.messages,
+                    "workers": args.workers,
+                    "seed": args.seed
+                }).result()
+            table.add_row(
+                f"{result['triggers']:,}",
+                str(result["size"]),
+                f"{result['setup']:.2f}",
+                f"{result['throughput']:,.0f}",
+                f"{result['p50'] * 1000:.3f}",
+                f"{result['p99'] * 1000:.3f}",
+                "n/a" if result["peak_memory"] is None else f"{result['peak_memory']:,.1f}"
+            )
+            print(f"Finished {triggers:,} triggers @ {size} chars", flush=True)
+
+    print(table.display())
+
+
+if __name__ == "__main__":
+    main()
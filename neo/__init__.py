@@ -35,6 +35,7 @@ class Neo(commands.Bot):
         self.session = None
         self.profiles: dict[int, containers.NeoUser] = {}
         self.configs: dict[int, containers.NeoGuildConfig] = {}
+        self.dm_channels: dict[int, int] = {}  # Maps user IDs to their DM channel IDs
 
         kwargs["command_prefix"] = self.get_prefix
         kwargs["activity"] = discord.Activity(
@@ -68,6 +69,10 @@ class Neo(commands.Bot):
         for record in await self.db.fetch("SELECT * FROM guild_configs"):
             await self.add_config(record["guild_id"], record=record)
 
+        # Load known DM channels, so DMs don't need to open a channel first
+        for record in await self.db.fetch("SELECT * FROM dm_channels"):
+            self.dm_channels[record["user_id"]] = record["channel_id"]
+
         self._async_ready.set()
         await self.verify_configs()
 
@@ -147,6 +152,11 @@ class Neo(commands.Bot):
         super().run(self.cfg["bot"]["token"])
 
     async def close(self):
+        try:
+            await self.broadcast("shutdown")  # Let addons persist anything they're holding
+        except Exception:
+            # Still close everything else, even if an addon couldn't persist its state
+            log.error("\n" + formatters.format_exception(sys.exc_info()))
         await self.session.close()
         await self.db.close()
         await super().close()
@@ -189,9 +199,33 @@ class Neo(commands.Bot):
     def get_user(self, id, *, as_partial=False):
         user = self._connection.get_user(id)
         if as_partial or not user:
-            user = partials.PartialUser(state=self._connection, id=id)
+            user = partials.PartialUser(
+                state=self._connection,
+                id=id,
+                dm_channel_id=self.dm_channels.get(id),
+                on_create_dm=self.add_dm_channel
+            )
         return user
 
+    def add_dm_channel(self, user_id: int, channel_id: int):
+        """Records a user's DM channel, in memory and in the database"""
+        if self.dm_channels.get(user_id) == channel_id:
+            return
+        self.dm_channels[user_id] = channel_id
+        self.loop.create_task(self.db.execute(
+            """
+            INSERT INTO dm_channels (
+                user_id,
+                channel_id
+            ) VALUES (
+                $1, $2
+            ) ON CONFLICT (user_id) DO UPDATE SET
+                channel_id=$2
+            """,
+            user_id,
+            channel_id
+        ))
+
     async def on_guild_remove(self, guild: discord.Guild):
         await self.delete_config(guild.id)
 
@@ -215,4 +249,4 @@ class Neo(commands.Bot):
 
         async def run_coros():
             await asyncio.gather(*coros)
-        self.loop.create_task(run_coros())
+        return self.loop.create_task(run_coros())
@@ -0,0 +1,917 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2021 nickofolas
+"""
+An auxiliary module for the `Highlights` addon
+"""
+import asyncio
+import bisect
+import contextlib
+import itertools
+import multiprocessing
+import queue
+import re
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict, deque
+from typing import Any, Callable, Hashable, Iterable, Iterator, Optional
+
+ESCAPED_CHAR = re.compile(r"\\(\W)")
+
+
+def is_word_char(char: str) -> bool:
+    """Mirrors the semantics of `\\w` for `str` patterns in the `re` module"""
+    return char.isalnum() or char == "_"
+
+
+def literal_trigger(content: str) -> str:
+    """
+    Resolves backslash escapes of non-word characters in highlight content
+
+    Highlights used to be compiled as regular expressions, so content like
+    `c\\+\\+` was the only way to match `c++`. Resolving escapes keeps such
+    highlights working now that content is always matched literally.
+    """
+    return ESCAPED_CHAR.sub(r"\1", content)
+
+
+def fold_case(text: str) -> str:
+    """
+    Lowercases text while keeping character offsets aligned with the original
+
+    `str.lower` can expand a handful of characters (e.g. `İ`), which would
+    desynchronize match offsets from the original text, so in that case
+    the text is folded per-character instead
+    """
+    folded = text.lower()
+    if len(folded) != len(text):
+        folded = "".join(c if len(low := c.lower()) != 1 else low for c in text)
+    return folded
+
+
+def changed_windows(old: str, new: str, margin: int) -> tuple[str, str]:
+    """
+    Returns the regions of `old` and `new` that differ, each widened by
+    `margin` characters on either side
+
+    Any trigger of at most `margin` characters that occurs in `new` but not
+    in `old` must overlap the changed region, so it lies within the returned
+    window of `new`. Equal strings yield empty windows.
+    """
+    if old == new:
+        return "", ""
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-suffix - 1] == new[-suffix - 1]:
+        suffix += 1
+
+    start = max(prefix - margin, 0)
+    return (
+        old[start:len(old) - max(suffix - margin, 0)],
+        new[start:len(new) - max(suffix - margin, 0)]
+    )
+
+
+def collect_values(matches: Iterable[tuple[int, int, set]]) -> set[Any]:
+    """
+    Merges the values of `finditer` results
+
+    Value sets are deduplicated by identity first, so a trigger that occurs
+    many times in one message only has its values merged once
+    """
+    unique = {id(values): values for *_, values in matches}
+    return set().union(*unique.values())
+
+
+class TriggerAutomaton:
+    """
+    An Aho-Corasick automaton for matching many highlight triggers at once
+
+    Triggers are matched as literals, case-insensitively, and can't begin or
+    end in the middle of a word, i.e. `(?<!\\w)` and `(?!\\w)` are enforced on
+    ends of the trigger that are word characters. Scanning is linear in the
+    length of the text, regardless of the number of triggers.
+
+    Once built, values can still be discarded, or added to triggers that
+    were already terminal when the automaton was built, without invalidating
+    any links. Any other addition requires a rebuild.
+    """
+
+    __slots__ = (
+        "_goto",
+        "_fail",
+        "_depth",
+        "_values",
+        "_terminal",
+        "_dict_link",
+        "_built"
+    )
+
+    def __init__(self, entries: Iterable[tuple[str, Hashable]] = ()):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._depth: list[int] = [0]
+        self._values: list[set] = [set()]
+        self._terminal: list[bool] = [False]
+        self._dict_link: list[int] = [0]
+        self._built = True
+
+        for trigger, value in entries:
+            self.add(trigger, value)
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} nodes={1}>".format(self, len(self._goto))
+
+    def _walk(self, trigger: str) -> Optional[int]:
+        node = 0
+        for char in fold_case(trigger):
+            if (node := self._goto[node].get(char)) is None:
+                return None
+        return node
+
+    def add(self, trigger: str, value: Hashable):
+        """Registers a value to be yielded whenever `trigger` is matched"""
+        node = 0
+        for char in fold_case(trigger):
+            if (next_node := self._goto[node].get(char)) is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._values.append(set())
+                self._terminal.append(False)
+                self._dict_link.append(0)
+                self._goto[node][char] = next_node
+            node = next_node
+
+        if not self._terminal[node]:
+            self._terminal[node] = True
+            self._built = False
+        self._values[node].add(value)
+
+    def try_add(self, trigger: str, value: Hashable) -> bool:
+        """
+        Adds a value without invalidating the automaton, if possible
+
+        Returns False, leaving the automaton untouched, if the trigger
+        wasn't terminal when the automaton was last built
+        """
+        if (node := self._walk(trigger)) is None or not self._terminal[node]:
+            return False
+        self._values[node].add(value)
+        return True
+
+    def discard(self, trigger: str, value: Hashable):
+        """Unregisters a value from a trigger. Links are left intact."""
+        if (node := self._walk(trigger)) is not None:
+            self._values[node].discard(value)
+
+    def build(self):
+        """Computes failure and dictionary links. Called lazily when needed."""
+        queue = deque()
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            self._dict_link[node] = 0
+            queue.append(node)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._goto[fallback].get(char, 0)
+                self._fail[child] = fail
+                self._dict_link[child] = fail if self._terminal[fail] else self._dict_link[fail]
+                queue.append(child)
+
+        self._built = True
+
+    def finditer(self, text: str) -> Iterator[tuple[int, int, set]]:
+        """Yields `(start, end, values)` for every trigger occurrence in `text`"""
+        if not self._built:
+            self.build()
+
+        goto, fail, depth = self._goto, self._fail, self._depth
+        values, terminal, dict_link = self._values, self._terminal, self._dict_link
+        length = len(text)
+        node = 0
+
+        for index, char in enumerate(fold_case(text)):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            match = node if terminal[node] else dict_link[node]
+            while match:
+                start, end = index - depth[match] + 1, index + 1
+                # Don't match partial words
+                if values[match] and not (
+                    (start > 0 and is_word_char(text[start - 1]) and is_word_char(text[start]))
+                    or (end < length and is_word_char(text[end]) and is_word_char(text[index]))
+                ):
+                    yield start, end, values[match]
+                match = dict_link[match]
+
+    def find(self, text: str) -> set[Any]:
+        """Returns every value whose trigger occurs in `text`"""
+        return collect_values(self.finditer(text))
+
+
+def build_automaton(entries: list[tuple[str, Hashable]]) -> TriggerAutomaton:
+    (automaton := TriggerAutomaton(entries)).build()
+    return automaton
+
+
+class HighlightMatcher:
+    """
+    Maintains a trigger automaton under frequent insertions and removals
+
+    Removals, and additions to triggers that already exist, are applied to
+    the main automaton in place. Other additions are kept in a small pending
+    automaton, which is cheap to rebuild. Once `compact_threshold` additions
+    are pending, the main automaton is rebuilt in an executor, off the event
+    loop, and changes made in the meantime are replayed onto it.
+    """
+
+    __slots__ = (
+        "_main",
+        "_pending",
+        "_delta",
+        "_entries",
+        "_journal",
+        "_compaction",
+        "compact_threshold",
+        "loop"
+    )
+
+    def __init__(
+        self,
+        entries: Iterable[tuple[str, Hashable]] = (),
+        *,
+        compact_threshold: int = 256,
+        loop: asyncio.AbstractEventLoop = None
+    ):
+        self._entries: set[tuple[str, Hashable]] = {*entries}
+        self._main = build_automaton([*self._entries])
+        self._pending: set[tuple[str, Hashable]] = set()
+        self._delta: Optional[TriggerAutomaton] = None
+        self._journal: Optional[list[tuple[bool, str, Hashable]]] = None
+        self._compaction: Optional[asyncio.Task] = None
+        self.compact_threshold = compact_threshold
+        self.loop = loop or asyncio.get_event_loop()
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} entries={1} pending={2}>".format(
+            self, len(self._entries), len(self._pending))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, trigger: str, value: Hashable):
+        self._entries.add((trigger, value))
+        if self._journal is not None:
+            self._journal.append((True, trigger, value))
+
+        if not self._main.try_add(trigger, value):
+            self._pending.add((trigger, value))
+            self._delta = None
+            if len(self._pending) >= self.compact_threshold and self._compaction is None:
+                self._compaction = self.loop.create_task(self.compact())
+
+    def discard(self, trigger: str, value: Hashable):
+        self._entries.discard((trigger, value))
+        if self._journal is not None:
+            self._journal.append((False, trigger, value))
+
+        self._main.discard(trigger, value)
+        if (trigger, value) in self._pending:
+            self._pending.discard((trigger, value))
+            self._delta = None
+
+    async def compact(self):
+        """Folds pending additions into the main automaton"""
+        self._journal = []
+        try:
+            main = await self.loop.run_in_executor(None, build_automaton, [*self._entries])
+            pending = set()
+            for added, trigger, value in self._journal:
+                if not added:
+                    main.discard(trigger, value)
+                    pending.discard((trigger, value))
+                elif not main.try_add(trigger, value):
+                    pending.add((trigger, value))
+            self._main, self._pending, self._delta = main, pending, None
+        finally:
+            self._journal = self._compaction = None
+
+    def finditer(self, text: str) -> Iterator[tuple[int, int, set]]:
+        yield from self._main.finditer(text)
+        if self._pending:
+            if self._delta is None:
+                self._delta = build_automaton([*self._pending])
+            yield from self._delta.finditer(text)
+
+    def find(self, text: str) -> set[Any]:
+        return collect_values(self.finditer(text))
+
+    async def search(self, text: str) -> set[Any]:
+        return self.find(text)
+
+
+def _run_shard(requests, results, entries: list[tuple[str, Hashable]]):
+    """Entrypoint for `ShardedMatcher` worker processes"""
+    automaton = build_automaton(entries)
+    results.send((None, None))  # Signals that the worker is ready
+    while True:
+        try:
+            op, *args = requests.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        if op == "find":
+            request_id, text = args
+            results.send((request_id, automaton.find(text)))
+        elif op == "add":
+            if not automaton.try_add(*args):
+                automaton.add(*args)  # Rebuilt lazily on the next search
+        elif op == "discard":
+            automaton.discard(*args)
+        elif op == "stop":
+            return
+
+
+class ShardedMatcher:
+    """
+    Matches triggers in a pool of worker processes, keeping CPU-bound
+    scanning off the event loop
+
+    Triggers are sharded across workers by their case-folded content, so
+    each worker holds only a fraction of the automaton. Every search is sent
+    to all workers, and their matches are merged. Since additions, removals,
+    and searches travel through the same pipe to a worker, they're applied
+    in the order they were made.
+
+    Pipes are written to from a thread per worker, so a worker that falls
+    behind never blocks the event loop. Workers that exit are respawned
+    from the shard's entries, which are mirrored here, as are workers that
+    don't answer a search within `search_timeout` seconds. If workers keep
+    exiting, matching falls back to an in-process `HighlightMatcher`.
+    """
+
+    __slots__ = (
+        "_workers",
+        "_shards",
+        "_waiters",
+        "_request_ids",
+        "_restarts",
+        "_fallback",
+        "_closed",
+        "max_restarts",
+        "restart_window",
+        "search_timeout",
+        "loop"
+    )
+
+    def __init__(
+        self,
+        entries: Iterable[tuple[str, Hashable]] = (),
+        *,
+        workers: int,
+        max_restarts: int = 3,
+        restart_window: float = 60,
+        search_timeout: float = 5,
+        loop: asyncio.AbstractEventLoop = None
+    ):
+        self._waiters: dict[int, tuple[int, asyncio.Future]] = {}
+        self._request_ids = itertools.count()
+        self._restarts: deque[float] = deque()
+        self._fallback: Optional[HighlightMatcher] = None
+        self._closed = False
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.search_timeout = search_timeout
+        self.loop = loop or asyncio.get_event_loop()
+
+        self._shards: list[set[tuple[str, Hashable]]] = [set() for _ in range(workers)]
+        for trigger, value in entries:
+            self._shards[self._shard_of(trigger, workers)].add((trigger, value))
+
+        self._workers = [self._spawn(worker) for worker in range(workers)]
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} workers={1}>".format(self, len(self._workers))
+
+    @staticmethod
+    def _shard_of(trigger: str, workers: int) -> int:
+        return zlib.crc32(fold_case(trigger).encode()) % workers
+
+    def _spawn(self, worker: int) -> tuple[multiprocessing.Process, queue.SimpleQueue, asyncio.Event]:
+        # Spawn rather than fork, since the parent process has a running loop
+        context = multiprocessing.get_context("spawn")
+        requests_recv, requests_send = context.Pipe(duplex=False)
+        results_recv, results_send = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_run_shard,
+            args=(requests_recv, results_send, [*self._shards[worker]]),
+            daemon=True
+        )
+        process.start()
+        requests_recv.close()
+        results_send.close()
+
+        pending = queue.SimpleQueue()
+        ready = asyncio.Event()
+        threading.Thread(target=self._write_requests, args=(requests_send, pending), daemon=True).start()
+        threading.Thread(
+            target=self._read_results, args=(worker, process, results_recv, ready), daemon=True).start()
+        return process, pending, ready
+
+    @staticmethod
+    def _write_requests(requests, pending: queue.SimpleQueue):
+        while (message := pending.get()) is not None:
+            try:
+                requests.send(message)
+            except OSError:
+                break  # The worker exited, its reader thread handles that
+        requests.close()
+
+    def _read_results(
+        self,
+        worker: int,
+        process: multiprocessing.Process,
+        results,
+        ready: asyncio.Event
+    ):
+        with contextlib.suppress(RuntimeError):  # The loop may close before the worker does
+            while True:
+                try:
+                    request_id, found = results.recv()
+                except (EOFError, OSError):
+                    break
+                if request_id is None:
+                    self.loop.call_soon_threadsafe(ready.set)
+                    continue
+                self.loop.call_soon_threadsafe(self._resolve, request_id, found)
+            self.loop.call_soon_threadsafe(self._handle_exit, worker, process)
+
+    def _resolve(self, request_id: int, found: set):
+        _, future = self._waiters.pop(request_id, (None, None))
+        if future is not None and not future.done():
+            future.set_result(found)
+
+    def _handle_exit(self, worker: int, process: multiprocessing.Process):
+        if self._closed or self._workers[worker][0] is not process:
+            return  # Already replaced
+        self._workers[worker][2].set()  # Release searches waiting for it to start
+
+        for request_id, (waiter_worker, future) in [*self._waiters.items()]:
+            if waiter_worker == worker:
+                del self._waiters[request_id]
+                if not future.done():
+                    future.set_exception(ConnectionError("A highlight matcher worker exited"))
+
+        now = time.monotonic()
+        self._restarts.append(now)
+        while self._restarts[0] < now - self.restart_window:
+            self._restarts.popleft()
+        if len(self._restarts) > self.max_restarts:
+            self._fallback = HighlightMatcher(
+                itertools.chain.from_iterable(self._shards), loop=self.loop)
+            self.close()
+            return
+
+        self._workers[worker][1].put(None)
+        self._workers[worker] = self._spawn(worker)
+
+    def _send(self, worker: int, message: tuple):
+        self._workers[worker][1].put(message)
+
+    def add(self, trigger: str, value: Hashable):
+        if self._fallback is not None:
+            return self._fallback.add(trigger, value)
+        worker = self._shard_of(trigger, len(self._workers))
+        self._shards[worker].add((trigger, value))
+        self._send(worker, ("add", trigger, value))
+
+    def discard(self, trigger: str, value: Hashable):
+        if self._fallback is not None:
+            return self._fallback.discard(trigger, value)
+        worker = self._shard_of(trigger, len(self._workers))
+        self._shards[worker].discard((trigger, value))
+        self._send(worker, ("discard", trigger, value))
+
+    async def _search(self, text: str) -> set[Any]:
+        request_ids, futures = [], []
+        for worker in range(len(self._workers)):
+            request_ids.append(request_id := next(self._request_ids))
+            futures.append(future := self.loop.create_future())
+            self._waiters[request_id] = (worker, future)
+            self._send(worker, ("find", request_id, text))
+        try:
+            # Workers that are still starting up, and building their automaton, aren't timed
+            await asyncio.gather(*(ready.wait() for _, _, ready in self._workers))
+            results = await asyncio.wait_for(asyncio.gather(*futures), self.search_timeout)
+        except asyncio.TimeoutError:
+            # A worker that's stuck is replaced just like one that exited
+            for worker, future in enumerate(futures):
+                if future.cancelled():  # Still unanswered when the search timed out
+                    process = self._workers[worker][0]
+                    process.kill()
+                    self._handle_exit(worker, process)
+            raise ConnectionError("A highlight matcher worker timed out") from None
+        finally:
+            for request_id in request_ids:
+                self._waiters.pop(request_id, None)
+        return set().union(*results)
+
+    async def search(self, text: str) -> set[Any]:
+        if self._fallback is None:
+            try:
+                return await self._search(text)
+            except ConnectionError:
+                pass  # Retried once the worker has been replaced
+        if self._fallback is not None:
+            return await self._fallback.search(text)
+        return await self._search(text)
+
+    def close(self):
+        self._closed = True
+        for _, pending, ready in self._workers:
+            pending.put(("stop",))
+            pending.put(None)
+            ready.set()
+
+
+class HighlightIndex:
+    """
+    Stores highlights by owner, with O(1) insertion and removal
+
+    Structures derived from the set of highlights subscribe to be notified
+    of each insertion and removal, instead of being recomputed from scratch
+    """
+
+    __slots__ = ("_by_user", "_count", "_subscribers")
+
+    def __init__(self):
+        self._by_user: dict[int, dict[str, Any]] = {}
+        self._count = 0
+        self._subscribers: list[tuple[Callable, Callable]] = []
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} owners={1} highlights={0._count}>".format(
+            self, len(self._by_user))
+
+    def __contains__(self, user_id: int):
+        return user_id in self._by_user
+
+    def __iter__(self):
+        for highlights in [*self._by_user.values()]:
+            yield from [*highlights.values()]
+
+    def __len__(self):
+        return self._count
+
+    def get(self, user_id: int) -> list:
+        """Returns a user's highlights, in the order they were added"""
+        return [*self._by_user.get(user_id, {}).values()]
+
+    def find(self, user_id: int, content: str):
+        return self._by_user.get(user_id, {}).get(content)
+
+    def subscribe(self, *, on_add: Callable, on_remove: Callable):
+        self._subscribers.append((on_add, on_remove))
+
+    def add(self, highlight):
+        highlights = self._by_user.setdefault(highlight.user_id, {})
+        if highlight.content in highlights:
+            return
+        highlights[highlight.content] = highlight
+        self._count += 1
+        for on_add, _ in self._subscribers:
+            on_add(highlight)
+
+    def remove(self, highlight):
+        highlights = self._by_user.get(highlight.user_id, {})
+        if highlights.pop(highlight.content, None) is None:
+            return
+        if not highlights:
+            del self._by_user[highlight.user_id]
+        self._count -= 1
+        for _, on_remove in self._subscribers:
+            on_remove(highlight)
+
+    def remove_user(self, user_id: int) -> list:
+        for highlight in (highlights := self.get(user_id)):
+            self.remove(highlight)
+        return highlights
+
+
+class GuildMembershipIndex:
+    """
+    Tracks which highlight owners are known not to belong to which guilds
+
+    Owners are recorded as absent when a member lookup fails, and cleared
+    when they're observed in the guild again. Absences expire after
+    `absent_ttl` seconds, as the member intent isn't available to tell us
+    when someone joins. Anyone not recorded as absent is treated as a
+    possible member.
+    """
+
+    __slots__ = ("absent", "absent_ttl")
+
+    def __init__(self, *, absent_ttl: int = 3600):
+        self.absent: defaultdict[int, dict[int, float]] = defaultdict(dict)
+        self.absent_ttl = absent_ttl
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} guilds={1}>".format(self, len(self.absent))
+
+    def add_member(self, guild_id: int, user_id: int):
+        if (absent := self.absent.get(guild_id)) is not None:
+            absent.pop(user_id, None)
+
+    def remove_member(self, guild_id: int, user_id: int):
+        self.absent[guild_id][user_id] = time.monotonic() + self.absent_ttl
+
+    def remove_guild(self, guild_id: int):
+        self.absent.pop(guild_id, None)
+
+    def remove_user(self, user_id: int):
+        for absent in self.absent.values():
+            absent.pop(user_id, None)
+
+    def may_be_member(self, guild_id: int, user_id: int) -> bool:
+        """Returns False only if the user is known not to be in the guild"""
+        if (absent := self.absent.get(guild_id)) is None:
+            return True
+        if (expiry := absent.get(user_id)) is None:
+            return True
+        if expiry <= time.monotonic():
+            del absent[user_id]
+            return True
+        return False
+
+
+class ChannelVisibilityCache:
+    """
+    Caches whether members can read channels
+
+    `TextChannel.members` evaluates permissions for every cached member of
+    the guild, so instead a single member's permissions are resolved on a
+    miss, and the result is kept. Results are stored alongside the roles
+    they were resolved with, so role changes are picked up even without
+    member update events. Anything else that affects permissions, i.e.
+    roles and overwrites, must be invalidated explicitly.
+    """
+
+    __slots__ = ("channels", "guilds")
+
+    def __init__(self):
+        self.channels: dict[int, dict[int, tuple[frozenset[int], bool]]] = {}
+        self.guilds: defaultdict[int, set[int]] = defaultdict(set)
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} channels={1}>".format(self, len(self.channels))
+
+    def can_read(self, channel, member) -> bool:
+        roles = frozenset(member._roles)
+        if (cached := self.channels.get(channel.id, {}).get(member.id)) is not None:
+            if cached[0] == roles:
+                return cached[1]
+
+        readable = channel.permissions_for(member).read_messages
+        if (members := self.channels.get(channel.id)) is None:
+            members = self.channels[channel.id] = {}
+            self.guilds[channel.guild.id].add(channel.id)
+        members[member.id] = (roles, readable)
+        return readable
+
+    def invalidate_channel(self, guild_id: int, channel_id: int):
+        self.channels.pop(channel_id, None)
+        if (channels := self.guilds.get(guild_id)) is not None:
+            channels.discard(channel_id)
+
+    def invalidate_guild(self, guild_id: int):
+        for channel_id in self.guilds.pop(guild_id, ()):
+            self.channels.pop(channel_id, None)
+
+    def remove_user(self, user_id: int):
+        for members in self.channels.values():
+            members.pop(user_id, None)
+
+
+class MessageSnapshot:
+    """A lightweight copy of the parts of a message needed for highlight context"""
+
+    __slots__ = (
+        "id",
+        "content",
+        "author_name",
+        "avatar_key",
+        "jump_url",
+        "attachments",
+        "embeds",
+        "stickers"
+    )
+
+    def __init__(
+        self,
+        *,
+        id: int,
+        content: str,
+        author_name: str,
+        avatar_key: int,
+        jump_url: str,
+        attachments: int = 0,
+        embeds: int = 0,
+        stickers: int = 0
+    ):
+        self.id = id
+        self.content = content
+        self.author_name = author_name
+        self.avatar_key = avatar_key
+        self.jump_url = jump_url
+        self.attachments = attachments
+        self.embeds = embeds
+        self.stickers = stickers
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} id={0.id}>".format(self)
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            id=message.id,
+            content=message.content,
+            author_name=message.author.display_name,
+            avatar_key=int(message.author.default_avatar.key),
+            jump_url=message.jump_url,
+            attachments=len(message.attachments),
+            embeds=len(message.embeds),
+            stickers=len(message.stickers)
+        )
+
+
+class ChannelHistoryCache:
+    """
+    Keeps a ring buffer of recent message snapshots for each channel
+
+    At most `max_channels` buffers of `per_channel` snapshots are held,
+    which caps memory usage. Once the cap is reached, the buffer of the
+    channel that has been idle the longest is evicted.
+    """
+
+    __slots__ = ("channels", "max_channels", "per_channel")
+
+    def __init__(self, *, max_channels: int = 1000, per_channel: int = 16):
+        self.channels: OrderedDict[int, deque[MessageSnapshot]] = OrderedDict()
+        self.max_channels = max_channels
+        self.per_channel = per_channel
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} channels={1}>".format(self, len(self.channels))
+
+    def append(self, channel_id: int, snapshot: MessageSnapshot):
+        if (buffer := self.channels.get(channel_id)) is None:
+            buffer = self.channels[channel_id] = deque(maxlen=self.per_channel)
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(channel_id)
+        buffer.append(snapshot)
+
+    def find(self, channel_id: int, message_id: int) -> Optional[MessageSnapshot]:
+        for snapshot in self.channels.get(channel_id, ()):
+            if snapshot.id == message_id:
+                return snapshot
+        return None
+
+    def remove(self, channel_id: int, message_id: int):
+        if (snapshot := self.find(channel_id, message_id)) is not None:
+            self.channels[channel_id].remove(snapshot)
+
+    def around(
+        self,
+        channel_id: int,
+        message_id: int,
+        *,
+        before: int = 3,
+        after: int = 2
+    ) -> Optional[list[MessageSnapshot]]:
+        """
+        Returns the snapshots surrounding a message, newest first, as
+        `TextChannel.history(around=...)` would. Returns None if the buffer
+        doesn't hold enough history before the message to cover the window.
+        """
+        buffer = [*self.channels.get(channel_id, ())]
+        for index, snapshot in enumerate(buffer):
+            if snapshot.id == message_id:
+                break
+        else:
+            return None
+
+        if index < before:
+            return None
+        return buffer[index - before:index + after + 1][::-1]
+
+
+class LatencyHistogram:
+    """
+    Counts latencies into fixed, roughly logarithmic buckets
+
+    Recording is O(1) and memory is constant, so a histogram can be kept
+    for every stage without bounding how long it runs for.
+    """
+
+    BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # ms
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)  # The last bucket is unbounded
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} count={0.count} mean={0.mean:.3f}ms>".format(self)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def record(self, elapsed: float):
+        """Records a latency, given in seconds"""
+        elapsed *= 1000
+        self.buckets[bisect.bisect_left(self.BOUNDS, elapsed)] += 1
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket holding the `q` quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, seen in zip(self.BOUNDS, itertools.accumulate(self.buckets)):
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.mean,
+            "max_ms": self.max,
+            "buckets": {
+                **{str(bound): count for bound, count in zip(self.BOUNDS, self.buckets)},
+                "inf": self.buckets[-1]
+            }
+        }
+
+
+class HighlightStats:
+    """
+    Per-stage counters and latency histograms for the highlight pipeline
+
+    Counters are plain names, grouped by a dotted prefix, e.g.
+    `rejected.blocked`. Stage latencies are recorded with `timed`.
+    """
+
+    __slots__ = ("counters", "stages", "since")
+
+    def __init__(self):
+        self.counters: Counter[str] = Counter()
+        self.stages: defaultdict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.since = time.time()
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} counters={1} stages={2}>".format(
+            self, len(self.counters), len(self.stages))
+
+    def incr(self, name: str, count: int = 1):
+        self.counters[name] += count
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage].record(time.perf_counter() - start)
+
+    def reset(self):
+        self.counters.clear()
+        self.stages.clear()
+        self.since = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "since": self.since,
+            "counters": dict(sorted(self.counters.items())),
+            "stages": {name: hist.to_dict() for name, hist in sorted(self.stages.items())}
+        }
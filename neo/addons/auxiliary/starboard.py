@@ -0,0 +1,283 @@
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2021 nickofolas
+"""
+An auxiliary module for the `Starboard` addon
+"""
+import asyncio
+from array import array
+from bisect import bisect_left
+from typing import Iterator, Optional
+
+import asyncpg
+
+
+class Star:
+    """A snapshot of a single star, as held by a `StarStore`"""
+
+    __slots__ = ("message_id", "channel_id", "author_id", "starboard_message_id", "stars")
+
+    def __init__(
+        self,
+        *,
+        message_id: int,
+        channel_id: int,
+        author_id: Optional[int],
+        starboard_message_id: int,
+        stars: int
+    ):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.starboard_message_id = starboard_message_id
+        self.stars = stars
+
+    def __repr__(self):
+        return (
+            "<{0.__class__.__name__} stars={0.stars} "
+            "message_id={0.message_id}>".format(self)
+        )
+
+
+class StarStore:
+    """
+    Compact storage for a starboard's stars
+
+    Stars are held in parallel arrays sorted by message ID, so each one
+    costs 36 bytes, rather than a `Star` and a `PartialMessage` object.
+    Lookups are binary searches. Since snowflakes increase over time, new
+    stars are almost always appended, rather than inserted.
+    `Star` objects are only created when a star is read.
+    """
+
+    __slots__ = ("message_ids", "channel_ids", "author_ids", "starboard_message_ids", "stars")
+
+    def __init__(self, records: list = ()):
+        rows = sorted(
+            (record["message_id"], record["channel_id"], record["author_id"] or 0,
+             record["starboard_message_id"], record["stars"])
+            for record in records
+        )
+        self.message_ids = array("Q", (row[0] for row in rows))
+        self.channel_ids = array("Q", (row[1] for row in rows))
+        self.author_ids = array("Q", (row[2] for row in rows))  # 0 if unknown
+        self.starboard_message_ids = array("Q", (row[3] for row in rows))
+        self.stars = array("I", (row[4] for row in rows))
+
+    @property
+    def columns(self) -> tuple[array, ...]:
+        return (self.message_ids, self.channel_ids, self.author_ids,
+                self.starboard_message_ids, self.stars)
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} size={1}>".format(self, len(self))
+
+    def __len__(self):
+        return len(self.message_ids)
+
+    def __contains__(self, message_id: int):
+        return self._index(message_id) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([*self.message_ids])
+
+    def _index(self, message_id: int) -> Optional[int]:
+        index = bisect_left(self.message_ids, message_id)
+        if index < len(self.message_ids) and self.message_ids[index] == message_id:
+            return index
+        return None
+
+    def _star(self, index: int) -> Star:
+        return Star(
+            message_id=self.message_ids[index],
+            channel_id=self.channel_ids[index],
+            author_id=self.author_ids[index] or None,
+            starboard_message_id=self.starboard_message_ids[index],
+            stars=self.stars[index]
+        )
+
+    def get(self, message_id: int) -> Optional[Star]:
+        if (index := self._index(message_id)) is None:
+            return None
+        return self._star(index)
+
+    def add(
+        self,
+        *,
+        message_id: int,
+        channel_id: int,
+        author_id: Optional[int],
+        starboard_message_id: int,
+        stars: int
+    ):
+        row = (message_id, channel_id, author_id or 0, starboard_message_id, stars)
+        if (index := self._index(message_id)) is not None:
+            for column, value in zip(self.columns, row):
+                column[index] = value
+            return
+
+        index = bisect_left(self.message_ids, message_id)
+        for column, value in zip(self.columns, row):
+            column.insert(index, value)
+
+    def set_stars(self, message_id: int, stars: int):
+        if (index := self._index(message_id)) is None:
+            raise KeyError(message_id)
+        self.stars[index] = stars
+
+    def pop(self, message_id: int) -> Optional[Star]:
+        if (index := self._index(message_id)) is None:
+            return None
+        star = self._star(index)
+        for column in self.columns:
+            del column[index]
+        return star
+
+    def discard_before(self, message_id: int) -> int:
+        """
+        Removes every star on a message older than the given snowflake, and
+        returns how many were removed. Being sorted, these are a prefix.
+        """
+        index = bisect_left(self.message_ids, message_id)
+        for column in self.columns:
+            del column[:index]
+        return index
+
+    def in_channel(self, channel_id: int) -> list[int]:
+        """Returns the IDs of every starred message in the given channel"""
+        return [
+            message_id for message_id, star_channel_id
+            in zip(self.message_ids, self.channel_ids)
+            if star_channel_id == channel_id
+        ]
+
+    def clear(self):
+        for column in self.columns:
+            del column[:]
+
+
+class StarWriteBuffer:
+    """
+    Gathers pending changes to the `stars` table, to be written in batches
+
+    Only the latest state of each star, keyed by `(guild_id, message_id)`,
+    is kept, so however many times a star changes between flushes, each
+    flush costs a single upsert and a single delete, in one transaction.
+    The batch being flushed is kept as `in_flight` until it's committed.
+    """
+
+    __slots__ = ("upserts", "deletes", "in_flight", "lock")
+
+    def __init__(self):
+        self.upserts: dict[tuple[int, int], tuple[int, int, int, Optional[int], int, int]] = {}
+        self.deletes: set[tuple[int, int]] = set()
+        self.in_flight: tuple[dict, set] = ({}, set())
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return "<{0.__class__.__name__} pending={1}>".format(self, len(self))
+
+    def __len__(self):
+        return len(self.upserts) + len(self.deletes)
+
+    def upsert(
+        self,
+        guild_id: int,
+        message_id: int,
+        channel_id: int,
+        author_id: Optional[int],
+        stars: int,
+        starboard_message_id: int
+    ):
+        key = (guild_id, message_id)
+        self.deletes.discard(key)
+        self.upserts[key] = (
+            guild_id, message_id, channel_id, author_id, stars, starboard_message_id)
+
+    def delete(self, guild_id: int, message_id: int):
+        key = (guild_id, message_id)
+        self.upserts.pop(key, None)
+        self.deletes.add(key)
+
+    def pending_for(self, guild_id: int) -> tuple[dict[int, dict], set[int]]:
+        """
+        Returns a guild's pending upserts, as rows keyed by message ID,
+        and the IDs of its pending deletes
+
+        This includes the batch being flushed, so it must be taken before
+        reading the guild's stars, as the batch may be committed meanwhile.
+        """
+        columns = (
+            "guild_id", "message_id", "channel_id", "author_id", "stars", "starboard_message_id")
+        upserts: dict[int, dict] = {}
+        deletes: set[int] = set()
+        # Changes that are still buffered are newer than the batch in flight
+        for batch_upserts, batch_deletes in (self.in_flight, (self.upserts, self.deletes)):
+            for (row_guild_id, message_id), row in batch_upserts.items():
+                if row_guild_id == guild_id:
+                    upserts[message_id] = dict(zip(columns, row))
+                    deletes.discard(message_id)
+            for row_guild_id, message_id in batch_deletes:
+                if row_guild_id == guild_id:
+                    deletes.add(message_id)
+                    upserts.pop(message_id, None)
+        return upserts, deletes
+
+    def discard_guild(self, guild_id: int):
+        """Drops all pending changes for a guild, e.g. once its stars are cleared"""
+        for key in [*self.upserts]:
+            if key[0] == guild_id:
+                del self.upserts[key]
+        self.deletes = {key for key in self.deletes if key[0] != guild_id}
+
+    async def flush(self, pool: asyncpg.Pool):
+        async with self.lock:  # Batches must be applied in the order they were taken
+            upserts, self.upserts = self.upserts, {}
+            deletes, self.deletes = self.deletes, set()
+            if not (upserts or deletes):
+                return
+            self.in_flight = (upserts, deletes)
+
+            try:
+                async with pool.acquire() as conn, conn.transaction():
+                    if deletes:
+                        await conn.execute(
+                            """
+                            DELETE FROM stars
+                            USING unnest($1::BIGINT[], $2::BIGINT[])
+                                AS deleted (guild_id, message_id)
+                            WHERE
+                                stars.guild_id=deleted.guild_id AND
+                                stars.message_id=deleted.message_id
+                            """,
+                            *map(list, zip(*deletes))
+                        )
+                    if upserts:
+                        await conn.execute(
+                            """
+                            INSERT INTO stars (
+                                guild_id,
+                                message_id,
+                                channel_id,
+                                author_id,
+                                stars,
+                                starboard_message_id
+                            ) SELECT * FROM unnest(
+                                $1::BIGINT[], $2::BIGINT[], $3::BIGINT[],
+                                $4::BIGINT[], $5::BIGINT[], $6::BIGINT[]
+                            ) ON CONFLICT (guild_id, message_id, channel_id) DO UPDATE SET
+                                author_id=COALESCE(EXCLUDED.author_id, stars.author_id),
+                                stars=EXCLUDED.stars,
+                                starboard_message_id=EXCLUDED.starboard_message_id
+                            """,
+                            *map(list, zip(*upserts.values()))
+                        )
+
+            except BaseException:
+                # Put the batch back, without clobbering anything newer
+                for key, row in upserts.items():
+                    if key not in self.upserts and key not in self.deletes:
+                        self.upserts[key] = row
+                self.deletes |= {key for key in deletes if key not in self.upserts}
+                raise
+            finally:
+                self.in_flight = ({}, set())
@@ -1,17 +1,32 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2021 nickofolas
+import asyncio
+import io
+import json
 import re
 from collections import defaultdict
-from functools import cached_property
 from operator import attrgetter
 
 import discord
 import neo
 from discord.ext import commands
-from neo.modules import ButtonsMenu
+from neo.modules import ButtonsMenu, Pages, args
 from neo.tools import is_registered_profile
-from neo.types.containers import TimedSet
-from neo.types.timer import periodic
+from neo.types.containers import TimedDict, TimedSet
+from neo.types.formatters import Table
+
+from .auxiliary.highlight import (
+    ChannelHistoryCache,
+    ChannelVisibilityCache,
+    GuildMembershipIndex,
+    HighlightIndex,
+    HighlightMatcher,
+    HighlightStats,
+    MessageSnapshot,
+    ShardedMatcher,
+    changed_windows,
+    literal_trigger
+)
 
 DEFAULT_AVATARS = [
     "<:_:863449882088833065>",
@@ -23,169 +38,505 @@ DEFAULT_AVATARS = [
 ]
 MAX_TRIGGERS = 10
 MAX_TRIGGER_LEN = 100
+MAX_SCAN_LENGTH = 4000
+MAX_CONCURRENT_SENDS = 10
+CONTEXT_CACHE_CHANNELS = 1000
+MATCHER_TIMEOUT = 5  # Seconds a matcher worker has to answer a search
+DELIVERY_DELAY = 5
+MAX_QUEUED_CHANNELS = 10  # One embed per channel, and a DM holds at most 10
+NOTIFIED_TTL = 3600
+NOTIFIED_MAX = 10000
+DELIVERY_BURST = 5  # A recipient can be sent this many highlight DMs...
+DELIVERY_PERIOD = 60  # ...per this many seconds, before they're digested
+DIGEST_INTERVAL = 300
 CUSTOM_EMOJI = re.compile(r"<a?:[a-zA-Z0-9_]{2,}:\d+>")
 
 
-def format_hl_context(message: discord.Message, is_trigger=False):
+def format_hl_context(message: MessageSnapshot, is_trigger=False, *, content=None):
     fmt = (
-        "[{0} **{1.author.display_name}**]({1.jump_url}) {1.content}"
+        "[{0} **{1.author_name}**]({1.jump_url}) {2}"
         if is_trigger else
-        "{0} **{1.author.display_name}** {1.content}"
+        "{0} **{1.author_name}** {2}"
     )
-    message.content = CUSTOM_EMOJI.sub("❔", message.content)  # Replace custom emojis to preserve formatting
+    content = CUSTOM_EMOJI.sub("❔", content or message.content)  # Replace custom emojis to preserve formatting
     if message.attachments:
-        message.content += " *[Attachment x{}]*".format(len(message.attachments))
+        content += " *[Attachment x{}]*".format(message.attachments)
     if message.embeds:
-        message.content += " *[Embed x{}]*".format(len(message.embeds))
+        content += " *[Embed x{}]*".format(message.embeds)
     if message.stickers:
-        message.content += " *[Sticker x{}]*".format(len(message.stickers))
+        content += " *[Sticker x{}]*".format(message.stickers)
 
     return fmt.format(
-        DEFAULT_AVATARS[int(message.author.default_avatar.key)],
-        message
+        DEFAULT_AVATARS[message.avatar_key],
+        message,
+        content
+    )
+
+
+async def build_hl_context(
+    message: discord.Message,
+    later_triggers: set[discord.Message],
+    history: ChannelHistoryCache,
+    stats: HighlightStats
+):
+    content = ""
+    triggers: set[int] = {message.id, *(m.id for m in later_triggers)}
+
+    # Only fall back to the API if the buffer can't cover the context window
+    if (snapshots := history.around(message.channel.id, message.id)) is None:
+        stats.incr("rest.history")
+        with stats.timed("history"):
+            snapshots = [*map(
+                MessageSnapshot.from_message,
+                await message.channel.history(limit=6, around=message).flatten()
+            )]
+    else:
+        stats.incr("context.buffered")
+
+    for m in snapshots:
+        omitted = len(content + m.content) > 1500  # Don't exceed embed limits
+        formatted = format_hl_context(
+            m, m.id in triggers, content="*[Omitted due to length]*" if omitted else None)
+        content = f"{formatted}\n{content}"
+
+    return neo.Embed(
+        title="In {0.guild.name}/#{0.channel.name}".format(message),
+        description=content,
+        timestamp=message.created_at
     )
 
 
 class Highlight:
-    __slots__ = ("bot", "content", "user_id", "pattern")
+    __slots__ = ("bot", "content", "user_id", "trigger")
 
     def __init__(self, bot: neo.Neo, *, content, user_id):
         self.bot = bot
         self.content = content
         self.user_id = user_id
-        self.pattern = re.compile(fr"\b{self.content}\b", re.I)
+        self.trigger = literal_trigger(content)  # Content is always matched literally
 
     def __repr__(self):
         return ("<{0.__class__.__name__} user_id={0.user_id!r} "
                 "content={0.content!r}>").format(self)
 
-    async def predicate(self, message):
-        if not message.guild:
-            return
-        if any([message.author.id == self.user_id,
+    async def predicate(
+        self,
+        message,
+        *,
+        index: GuildMembershipIndex,
+        visibility: ChannelVisibilityCache,
+        blocks: frozenset[int],
+        entities: frozenset[int],
+        mentions: frozenset[int],
+        stats: HighlightStats
+    ):
+        if any([not message.guild,
+                message.author.id == self.user_id,
                 message.author.bot]):
-            return
+            return stats.incr("rejected.author")
         if self.bot.profiles[self.user_id].receive_highlights is False:
-            return  # Don't highlight users who have disabled highlight receipt
+            # Don't highlight users who have disabled highlight receipt
+            return stats.incr("rejected.receipt_disabled")
 
-        blacklist = self.bot.profiles[self.user_id].hl_blocks
-        if any(attrgetter(attr)(message) in blacklist for attr in (
-                "id", "guild.id", "channel.id", "author.id")
-               ):
-            return
+        if not blocks.isdisjoint(entities):  # Message, guild, channel, or author is blocked
+            return stats.incr("rejected.blocked")
 
-        if self.user_id in [m.id for m in message.mentions]:
-            return  # Don't highlight users with messages they are mentioned in
+        if self.user_id in mentions:
+            # Don't highlight users with messages they are mentioned in
+            return stats.incr("rejected.mentioned")
 
         try:  # This lets us update the channel members and make sure the user exists
-            member = await message.guild.fetch_member(self.user_id, cache=True)
+            stats.incr("rest.fetch_member")
+            with stats.timed("fetch_member"):
+                member = await message.guild.fetch_member(self.user_id, cache=True)
         except discord.NotFound:
-            return
-
-        if isinstance(message.channel, discord.Thread):
-            if message.channel.is_private():  # Ignore private threads
-                return
-            members = message.channel.parent.members
-        else:
-            members = message.channel.members
-        if member not in members:  # Check channel membership
-            return
+            index.remove_member(message.guild.id, self.user_id)
+            return stats.incr("rejected.not_member")
+        index.add_member(message.guild.id, self.user_id)
+
+        channel = message.channel
+        if isinstance(channel, discord.Thread):
+            if channel.is_private():  # Ignore private threads
+                return stats.incr("rejected.private_thread")
+            channel = channel.parent
+        if not visibility.can_read(channel, member):  # Check channel membership
+            return stats.incr("rejected.no_channel_access")
 
         return True
 
-    async def to_send_kwargs(self, message, later_triggers: set[discord.Message]):
-        content = ""
-        triggers: set[discord.Message] = {message, *later_triggers}
-        for m in await message.channel.history(limit=6, around=message).flatten():
-            if len(content + m.content) > 1500:  # Don't exceed embed limits
-                m.content = "*[Omitted due to length]*"
-            formatted = format_hl_context(m, m in triggers)
-            content = f"{formatted}\n{content}"
-
-        embed = neo.Embed(
-            title="In {0.guild.name}/#{0.channel.name}".format(message),
-            description=content,
-            timestamp=message.created_at
-        )
-        return {
-            "content": "{0.author}: {0.content}".format(message)[:1500],
-            "embed": embed
-        }
-
-    def matches(self, other):
-        return self.pattern.search(other)
-
 
 class Highlights(neo.Addon):
     """Commands for managing highlights"""
 
     def __init__(self, bot: neo.Neo):
         self.bot = bot
-        self.highlights: defaultdict[str, list[Highlight]] = defaultdict(list)
+        self.highlights = HighlightIndex()
+        self.matcher = HighlightMatcher(loop=bot.loop)
         self.grace_periods: dict[int, TimedSet] = {}
         self.queued_highlights: defaultdict[int, dict] = defaultdict(dict)
+        self.delivery_timers: dict[int, asyncio.TimerHandle] = {}
+        self.digests: defaultdict[int, dict[int, list]] = defaultdict(dict)
+        self.digest_timers: dict[int, asyncio.TimerHandle] = {}
+        self.guild_index = GuildMembershipIndex()
+        self.visibility = ChannelVisibilityCache()
+        self.blocklists: dict[int, frozenset[int]] = {}
+        self.stats = HighlightStats()
+        self.highlights.subscribe(on_add=self.index_highlight, on_remove=self.unindex_highlight)
+
+        settings = bot.cfg.get("highlights", {})
+        self.delivery_limit = asyncio.Semaphore(
+            settings.get("max_concurrent_sends", MAX_CONCURRENT_SENDS))
+        self.max_scan_length = settings.get("max_scan_length", MAX_SCAN_LENGTH)
+        self.recent_messages = ChannelHistoryCache(
+            max_channels=settings.get("context_cache_channels", CONTEXT_CACHE_CHANNELS))
+        self.delivery_delay = settings.get("delivery_delay", DELIVERY_DELAY)
+        self.max_queued_channels = settings.get("max_queued_channels", MAX_QUEUED_CHANNELS)
+        # Shared across recipients so each context is only built once
+        self.contexts = TimedDict(decay_time=max(self.delivery_delay * 2, 30), loop=bot.loop)
+        self.delivery_burst = settings.get("delivery_burst", DELIVERY_BURST)
+        self.delivery_period = settings.get("delivery_period", DELIVERY_PERIOD)
+        # Full buckets are indistinguishable from new ones, so idle buckets are dropped
+        self.delivery_buckets = TimedDict(decay_time=self.delivery_period, loop=bot.loop)
+        self.digest_interval = settings.get("digest_interval", DIGEST_INTERVAL)
+        # (message ID, user ID) pairs that have already been highlighted, so edits don't re-notify
+        self.notified = TimedSet(
+            decay_time=NOTIFIED_TTL,
+            maxsize=settings.get("notified_cache_size", NOTIFIED_MAX),
+            loop=bot.loop
+        )
         bot.loop.create_task(self.__ainit__())
 
     async def __ainit__(self):
         await self.bot.wait_until_ready()
 
-        for record in await self.bot.db.fetch("SELECT * FROM highlights"):
-            self.highlights[record["user_id"]].append(Highlight(self.bot, **record))
+        records = await self.bot.db.fetch("SELECT * FROM highlights")
+        highlights = [Highlight(self.bot, **record) for record in records]
+
+        # Build the automaton in one pass, rather than incrementally
+        entries = [(hl.trigger, (hl.user_id, hl.content))
+                   for hl in [*self.highlights, *highlights]]
+        settings = self.bot.cfg.get("highlights", {})
+        if (workers := settings.get("matcher_workers", 0)) > 0:
+            self.matcher = ShardedMatcher(
+                entries,
+                workers=workers,
+                search_timeout=settings.get("matcher_timeout", MATCHER_TIMEOUT),
+                loop=self.bot.loop
+            )
+        else:
+            self.matcher = HighlightMatcher(entries, loop=self.bot.loop)
+        for hl in highlights:
+            self.highlights.add(hl)
 
         for profile in self.bot.profiles.values():
             self.grace_periods[profile.user_id] = TimedSet(
                 decay_time=profile.hl_timeout * 60
             )
 
-        self.send_queued_highlights.start()
-
     def cog_unload(self):
-        self.send_queued_highlights.shutdown()
-
-    @cached_property  # Cache this so it isn't re-computed after every message
-    def flat_highlights(self):
-        return [hl for hl_list in self.highlights.values() for hl in hl_list]
+        for timer in [*self.delivery_timers.values(), *self.digest_timers.values()]:
+            timer.cancel()
+        self.delivery_timers.clear()
+        self.digest_timers.clear()
+        if isinstance(self.matcher, ShardedMatcher):
+            self.matcher.close()
+
+    def index_highlight(self, hl: Highlight):
+        self.matcher.add(hl.trigger, (hl.user_id, hl.content))
+
+    def unindex_highlight(self, hl: Highlight):
+        self.matcher.discard(hl.trigger, (hl.user_id, hl.content))
+        if hl.user_id not in self.highlights:
+            self.guild_index.remove_user(hl.user_id)
+            self.visibility.remove_user(hl.user_id)
+
+    async def matching_highlights(
+        self,
+        content: str,
+        guild_id: int,
+        *,
+        exclude: str = None
+    ) -> list[Highlight]:
+        """
+        Returns every highlight triggered by the given content in the given guild
 
-    def recompute_flattened(self):
-        if hasattr(self, "flat_highlights"):
-            del self.flat_highlights
-        self.flat_highlights
+        Highlights that are also triggered by `exclude` are left out
+        """
+        matched = []
+        # Scanning is linear, so bounding the scanned length bounds the work per message
+        values = await self.matcher.search(content[:self.max_scan_length])
+        if exclude and values:
+            values = values - await self.matcher.search(exclude[:self.max_scan_length])
+        for user_id, hl_content in values:
+            if not self.guild_index.may_be_member(guild_id, user_id):
+                continue
+            if (hl := self.highlights.find(user_id, hl_content)) is not None:
+                matched.append(hl)
+        return matched
 
     @commands.Cog.listener("on_message")
     async def listen_for_highlights(self, message):
-        if message.author.id in {hl.user_id for hl in self.flat_highlights}:
-            self.grace_periods[message.author.id].add(message.channel.id)
+        if message.guild:
+            self.recent_messages.append(
+                message.channel.id, MessageSnapshot.from_message(message))
 
-        for hl in filter(lambda hl: hl.matches(message.content), self.flat_highlights):
-            if message.channel.id in self.grace_periods[hl.user_id]:
+        if message.author.id in self.highlights:
+            self.grace_periods[message.author.id].add(message.channel.id)
+            if message.guild:
+                self.guild_index.add_member(message.guild.id, message.author.id)
+
+        if not message.guild or message.author.bot:
+            return  # Highlights are never triggered outside of guilds, or by bots
+
+        self.stats.incr("messages_scanned")
+        with self.stats.timed("match"):
+            matched = await self.matching_highlights(message.content, message.guild.id)
+        self.stats.incr("candidates_matched", len(matched))
+        await self.dispatch_highlights(message, matched)
+
+    async def dispatch_highlights(self, message: discord.Message, matched: list[Highlight]):
+        entities = mentions = None  # Only computed once a trigger matches
+        for hl in matched:
+            if (message.id, hl.user_id) in self.notified:
+                self.stats.incr("rejected.already_notified")
                 continue
-            if not await hl.predicate(message):
+            if message.channel.id in self.grace_periods[hl.user_id]:
+                self.stats.incr("rejected.grace_period")
                 continue
-            channel_queue = self.queued_highlights[message.channel.id]
-            if hl.user_id not in self.queued_highlights[message.channel.id]:
-                channel_queue[hl.user_id] = (hl, message, set())
+            if entities is None:
+                entities = frozenset((message.id, message.guild.id,
+                                      message.channel.id, message.author.id))
+                mentions = frozenset(m.id for m in message.mentions)
+            with self.stats.timed("predicate"):
+                accepted = await hl.predicate(
+                    message,
+                    index=self.guild_index,
+                    visibility=self.visibility,
+                    blocks=self.get_blocklist(hl.user_id),
+                    entities=entities,
+                    mentions=mentions,
+                    stats=self.stats
+                )
+            if accepted:
+                self.stats.incr("candidates_accepted")
+                self.queue_highlight(hl, message)
+
+    def get_blocklist(self, user_id: int) -> frozenset[int]:
+        if (blocks := self.blocklists.get(user_id)) is None:
+            blocks = self.blocklists[user_id] = frozenset(self.bot.profiles[user_id].hl_blocks)
+        return blocks
+
+    @commands.Cog.listener("on_raw_message_edit")
+    async def listen_for_edited_highlights(self, payload):
+        """
+        Highlights triggers that an edit added to a message
+
+        Only the region of the content that the edit changed is rescanned,
+        and recipients who were already highlighted for the message are skipped
+        """
+        if "content" not in payload.data:
+            return  # Not a content edit, e.g. an embed being resolved
+        content = payload.data["content"]
+
+        snapshot = self.recent_messages.find(payload.channel_id, payload.message_id)
+        if payload.cached_message is not None:
+            old_content = payload.cached_message.content
+        else:
+            old_content = getattr(snapshot, "content", None)
+        if snapshot is not None:
+            snapshot.content = content
+
+        if old_content is None or "author" not in payload.data:
+            return  # Without the original content, there's nothing to diff against
+        if payload.data["author"].get("bot") or not payload.data.get("guild_id"):
+            return  # Highlights are never triggered outside of guilds, or by bots
+        if (channel := self.bot.get_channel(payload.channel_id)) is None:
+            return
+
+        old_window, new_window = changed_windows(
+            old_content[:self.max_scan_length],
+            content[:self.max_scan_length],
+            MAX_TRIGGER_LEN + 1  # One extra character to account for word boundaries
+        )
+        if not new_window:
+            return
+
+        self.stats.incr("edits_scanned")
+        with self.stats.timed("match"):
+            matched = await self.matching_highlights(
+                new_window, channel.guild.id, exclude=old_window)
+        self.stats.incr("candidates_matched", len(matched))
+        if matched:
+            message = discord.Message(
+                state=self.bot._connection, channel=channel, data=payload.data)
+            await self.dispatch_highlights(message, matched)
+
+    @commands.Cog.listener("on_raw_message_delete")
+    async def remove_recent_message(self, payload):
+        self.recent_messages.remove(payload.channel_id, payload.message_id)
+
+    @commands.Cog.listener("on_guild_remove")
+    async def index_removed_guild(self, guild):
+        self.guild_index.remove_guild(guild.id)
+        self.visibility.invalidate_guild(guild.id)
+
+    @commands.Cog.listener("on_guild_role_update")
+    @commands.Cog.listener("on_guild_role_delete")
+    async def invalidate_role_visibility(self, role, *_):
+        self.visibility.invalidate_guild(role.guild.id)
+
+    @commands.Cog.listener("on_guild_channel_update")
+    @commands.Cog.listener("on_guild_channel_delete")
+    async def invalidate_channel_visibility(self, channel, *_):
+        if isinstance(channel, discord.CategoryChannel):
+            # Synced channels derive their overwrites from their category
+            self.visibility.invalidate_guild(channel.guild.id)
+        else:
+            self.visibility.invalidate_channel(channel.guild.id, channel.id)
+
+    def queue_highlight(self, hl: Highlight, message: discord.Message):
+        """
+        Queues a highlight for delivery
+
+        The first highlight queued for a recipient opens a debounce window,
+        and everything queued within it is delivered together once it closes,
+        or as soon as the recipient's queue is full.
+        """
+        self.notified.add((message.id, hl.user_id))
+        user_queue = self.queued_highlights[hl.user_id]
+        if message.channel.id not in user_queue:
+            user_queue[message.channel.id] = (hl, message, set())
+        else:
+            user_queue[message.channel.id][2].add(message)
+
+        if len(user_queue) >= self.max_queued_channels:
+            self.flush_highlights(hl.user_id)
+        elif hl.user_id not in self.delivery_timers:
+            self.delivery_timers[hl.user_id] = self.bot.loop.call_later(
+                self.delivery_delay, self.flush_highlights, hl.user_id)
+
+    def flush_highlights(self, user_id: int):
+        if (timer := self.delivery_timers.pop(user_id, None)) is not None:
+            timer.cancel()
+        if not (queued := self.queued_highlights.pop(user_id, None)):
+            return
+
+        if (bucket := self.delivery_buckets.get(user_id)) is None:
+            bucket = self.delivery_buckets[user_id] = commands.Cooldown(
+                self.delivery_burst, self.delivery_period)
+        else:
+            self.delivery_buckets[user_id] = bucket  # Refresh the bucket's expiry
+        if bucket.update_rate_limit():
+            self.digest_highlights(user_id, [*queued.values()])
+        else:
+            self.bot.loop.create_task(self.deliver_highlights(user_id, [*queued.values()]))
+
+    def digest_highlights(self, user_id: int, queued: list[tuple]):
+        """
+        Folds highlights into a recipient's digest, for once they've used up
+        their delivery bucket. Digests are sent every `digest_interval` seconds,
+        as a single DM, for as long as they have highlights in them.
+        """
+        digest = self.digests[user_id]
+        for _, message, later_triggers in queued:
+            count = len(later_triggers) + 1
+            latest = max((message, *later_triggers), key=lambda m: m.id)
+            if (entry := digest.get(message.channel.id)) is None:
+                digest[message.channel.id] = [latest, count]
             else:
-                channel_queue[hl.user_id][2].add(message)
-
-    @periodic(5)
-    async def send_queued_highlights(self):
-        queue = self.queued_highlights.copy()
-        self.queued_highlights.clear()
-        for hl, message, later_triggers in [
-            pair for nested in queue.values() for pair in nested.values()
-        ]:
-            await self.bot.get_user(hl.user_id, as_partial=True).send(
-                **await hl.to_send_kwargs(message, later_triggers)
-            )
+                # Link to the most recent highlight in the channel
+                entry[0] = max(entry[0], latest, key=lambda m: m.id)
+                entry[1] += count
+        self.stats.incr("highlights_digested", len(queued))
+
+        if user_id not in self.digest_timers:
+            self.digest_timers[user_id] = self.bot.loop.call_later(
+                self.digest_interval, self.flush_digest, user_id)
+
+    def flush_digest(self, user_id: int):
+        self.digest_timers.pop(user_id, None)
+        if digest := self.digests.pop(user_id, None):
+            self.bot.loop.create_task(self.deliver_digest(user_id, [*digest.values()]))
+
+    async def deliver_digest(self, user_id: int, digest: list[list]):
+        lines = [
+            "**{1}** in {0.guild.name}/#{0.channel.name} ([jump]({0.jump_url}))".format(
+                message, count)
+            for message, count in sorted(digest, key=lambda entry: entry[1], reverse=True)
+        ]
+        description = ""
+        for index, line in enumerate(lines):
+            if len(description) + len(line) > 3900:  # Stay within the description limit
+                description += "*...and {} more channels*".format(len(lines) - index)
+                break
+            description += line + "\n"
+
+        embed = neo.Embed(
+            title="Highlight digest",
+            description=description
+        ).set_footer(text="Highlights are digested while you're receiving a lot of them")
+        async with self.delivery_limit:
+            try:
+                self.stats.incr("rest.dm_send")
+                with self.stats.timed("send"):
+                    await self.bot.get_user(user_id, as_partial=True).send(embed=embed)
+            except discord.HTTPException:
+                self.stats.incr("deliveries_failed")
+
+    def get_context(self, message, later_triggers):
+        key = (message.id, frozenset(m.id for m in later_triggers))
+        if key not in self.contexts:
+            self.contexts[key] = asyncio.create_task(
+                build_hl_context(message, later_triggers, self.recent_messages, self.stats))
+        return self.contexts[key]
+
+    async def deliver_highlights(self, user_id: int, queued: list[tuple]):
+        """Merges all of a recipient's queued highlights into as few DMs as possible"""
+        async with self.delivery_limit:
+            with self.stats.timed("deliver"):
+                try:
+                    with self.stats.timed("context"):
+                        embeds = await asyncio.gather(*(
+                            self.get_context(message, later_triggers)
+                            for _, message, later_triggers in queued
+                        ))
+                    dest = self.bot.get_user(user_id, as_partial=True)
+
+                    # Split into chunks that respect Discord's per-message embed limits
+                    chunk, chunk_len = [], 0
+                    for (_, message, _), embed in zip(queued, embeds):
+                        if chunk and (len(chunk) >= 10 or chunk_len + len(embed) > 6000):
+                            await self.send_delivery(dest, chunk)
+                            chunk, chunk_len = [], 0
+                        chunk.append((message, embed))
+                        chunk_len += len(embed)
+                    await self.send_delivery(dest, chunk)
+
+                except discord.HTTPException:
+                    # The recipient may have DMs disabled, or the context may be inaccessible
+                    self.stats.incr("deliveries_failed")
+
+    async def send_delivery(self, dest, chunk: list[tuple[discord.Message, neo.Embed]]):
+        self.stats.incr("rest.dm_send")
+        with self.stats.timed("send"):
+            await dest.send(**self.format_delivery(chunk))
+        self.stats.incr("highlights_delivered", len(chunk))
+
+    @staticmethod
+    def format_delivery(chunk: list[tuple[discord.Message, neo.Embed]]):
+        return {
+            "content": "\n".join(
+                "{0.author}: {0.content}".format(message)[:1500 // len(chunk)]
+                for message, _ in chunk
+            ),
+            "embeds": [embed for _, embed in chunk]
+        }
 
     @neo.Addon.recv("user_settings_update")
     async def handle_update_profile(self, user, profile):
-        if self.grace_periods.get(user.id):
-            current_timeout = self.grace_periods[user.id].decay_time
-            if (profile.hl_timeout * 60) == current_timeout:
-                return
-            for item in (t_set := self.grace_periods.pop(user.id)):
-                t_set.running.pop(item).cancel()
+        if (grace_period := self.grace_periods.get(user.id)) is not None:
+            grace_period.decay_time = profile.hl_timeout * 60
+            return
 
         self.grace_periods[profile.user_id] = TimedSet(
             decay_time=profile.hl_timeout * 60
@@ -195,8 +546,8 @@ class Highlights(neo.Addon):
     @neo.Addon.recv("profile_delete")
     async def handle_deleted_profile(self, user_id: int):
         self.grace_periods.pop(user_id, None)
-        self.highlights.pop(user_id, None)
-        self.recompute_flattened()
+        self.blocklists.pop(user_id, None)
+        self.highlights.remove_user(user_id)
 
     async def cog_check(self, ctx):
         return await is_registered_profile().predicate(ctx)
@@ -209,7 +560,7 @@ class Highlights(neo.Addon):
     async def highlight_list(self, ctx):
         """List your highlights"""
         description = ""
-        user_highlights = self.highlights.get(ctx.author.id, [])
+        user_highlights = self.highlights.get(ctx.author.id)
 
         for index, hl in enumerate(user_highlights, 1):
             description += "`{0}` `{1}`\n".format(
@@ -233,6 +584,7 @@ class Highlights(neo.Addon):
         - Highlights will __never__ be triggered from private threads
         - Highlights will __never__ be triggered by bots
         - You must be a member of a channel to be highlighted in it
+        - Highlights are matched as plain, case-insensitive text, not as regex
         """
         if len(content) <= 1:
             raise ValueError("Highlights must contain more than 1 character.")
@@ -240,10 +592,10 @@ class Highlights(neo.Addon):
             raise ValueError(
                 f"Highlights cannot be longer than {MAX_TRIGGER_LEN:,} characters!")
 
-        if len(self.highlights.get(ctx.author.id, [])) >= MAX_TRIGGERS:
+        if len(self.highlights.get(ctx.author.id)) >= MAX_TRIGGERS:
             raise ValueError("You've used up all of your highlight slots!")
 
-        if content in [hl.content for hl in self.highlights.get(ctx.author.id, [])]:
+        if self.highlights.find(ctx.author.id, content):
             raise ValueError("Cannot have multiple highlights with the same content.")
 
         result = await self.bot.db.fetchrow(
@@ -257,8 +609,9 @@ class Highlights(neo.Addon):
             ctx.author.id,
             content
         )
-        self.highlights[ctx.author.id].append(Highlight(self.bot, **result))
-        self.recompute_flattened()
+        self.highlights.add(Highlight(self.bot, **result))
+        if ctx.guild:
+            self.guild_index.add_member(ctx.guild.id, ctx.author.id)
         await ctx.message.add_reaction("\U00002611")
 
     @highlight.command(name="remove", aliases=["rm"])
@@ -268,18 +621,18 @@ class Highlights(neo.Addon):
 
         Passing `~` will remove all highlights at once
         """
+        user_highlights = self.highlights.get(ctx.author.id)
         if "~" in indices:
-            highlights = self.highlights.get(ctx.author.id, []).copy()
-            self.highlights.pop(ctx.author.id, None)
+            highlights = user_highlights
 
         else:
-            (indices := [*map(str, indices)]).sort(reverse=True)  # Pop in an way that preserves the list's original order
-            try:
-                highlights = [self.highlights[ctx.author.id].pop(index - 1) for index in map(
-                    int, filter(str.isdigit, indices))
-                ]
-            except IndexError:
+            indices = {*map(int, filter(str.isdigit, map(str, indices)))}
+            if not all(0 < index <= len(user_highlights) for index in indices):
                 raise IndexError("One or more of the provided indices is invalid.")
+            highlights = [user_highlights[index - 1] for index in indices]
+
+        for hl in highlights:
+            self.highlights.remove(hl)
 
         await self.bot.db.execute(
             """
@@ -292,7 +645,6 @@ class Highlights(neo.Addon):
             ctx.author.id,
             [*map(attrgetter("content"), highlights)]
         )
-        self.recompute_flattened()
         await ctx.message.add_reaction("\U00002611")
 
     def perform_blocklist_action(self, *, profile, ids, action="block"):
@@ -305,6 +657,7 @@ class Highlights(neo.Addon):
             blacklist |= ids
 
         profile.hl_blocks = [*blacklist]
+        self.blocklists[profile.user_id] = frozenset(blacklist)
 
     @highlight.command(name="block")
     async def highlight_block(self, ctx, ids: commands.Greedy[int]):
@@ -350,6 +703,45 @@ class Highlights(neo.Addon):
         self.perform_blocklist_action(profile=profile, ids=ids, action="unblock")
         await ctx.message.add_reaction("\U00002611")
 
+    @args.add_arg("-e", "--export", action="store_true", help="Attach the raw stats as JSON")
+    @args.add_arg("-r", "--reset", action="store_true", help="Reset the stats once shown")
+    @highlight.arg_command(name="stats")
+    @commands.is_owner()
+    async def highlight_stats(self, ctx, *, args):
+        """View per-stage highlight pipeline stats"""
+        stages = Table()
+        stages.init_columns("Stage", "Count", "Mean (ms)", "p50 (ms)", "p99 (ms)", "Max (ms)")
+        for name, hist in sorted(self.stats.stages.items()):
+            stages.add_row(name, f"{hist.count:,}", *(f"{ms:.2f}" for ms in (
+                hist.mean, hist.quantile(0.5), hist.quantile(0.99), hist.max)))
+
+        counters = Table()
+        counters.init_columns("Counter", "Value")
+        for name, value in sorted(self.stats.counters.items()):
+            counters.add_row(name, f"{value:,}")
+
+        pages = Pages(
+            "{0}\n\n{1}".format(
+                stages.display() if stages.rows else "No stages recorded",
+                counters.display() if counters.rows else "No counters recorded"
+            ),
+            1500,
+            joiner="",
+            prefix="```\n",
+            suffix="\n```"
+        )
+        menu = ButtonsMenu(pages)
+        await menu.start(ctx)
+
+        if args.export:
+            await ctx.send(file=discord.File(
+                io.BytesIO(json.dumps(self.stats.to_dict(), indent=2).encode()),
+                filename="highlight_stats.json"
+            ))
+
+        if args.reset:
+            self.stats.reset()
+
 
 def setup(bot):
     bot.add_cog(Highlights(bot))
@@ -1,15 +1,59 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2021 nickofolas
 import asyncio
-from datetime import datetime, timezone
-from typing import Union
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
+from weakref import WeakValueDictionary
 
 import discord
 import neo
 from discord.ext import commands
 from neo.modules import ButtonsMenu
 from neo.tools import convert_setting, shorten
+from neo.types.containers import TimedDict
 from neo.types.converters import max_days_converter
+from neo.types.timer import periodic
+
+from .auxiliary.starboard import Star, StarStore, StarWriteBuffer
+
+EDIT_DELAY = 5
+COUNTER_TTL = 3600
+COUNTER_SIZE = 5000
+MAX_CACHED_STARS = 100_000
+SWEEP_INTERVAL = 3600
+FLUSH_INTERVAL = 10
+RECONCILE_CONCURRENCY = 2
+RECONCILE_BURST = 5
+RECONCILE_PERIOD = 5
+LEADERBOARD_SIZE = 10
+
+# Each leaderboard reads straight off an index ordered by star count, so
+# none of them need to scan or aggregate the stars table
+LEADERBOARD_QUERIES = {
+    "messages": """
+        SELECT message_id, channel_id, stars
+        FROM stars
+        WHERE guild_id=$1
+        ORDER BY stars DESC
+        LIMIT $2
+    """,
+    "authors": """
+        SELECT author_id, stars, messages
+        FROM star_authors
+        WHERE guild_id=$1
+        ORDER BY stars DESC
+        LIMIT $2
+    """,
+    "channels": """
+        SELECT channel_id, stars, messages
+        FROM star_channels
+        WHERE guild_id=$1
+        ORDER BY stars DESC
+        LIMIT $2
+    """
+}
 
 SETTINGS_MAPPING = {
     "channel": {
@@ -35,28 +79,14 @@ SETTINGS_MAPPING = {
 }
 
 
-class Star:
-    __slots__ = ("message_id", "starboard_message", "stars")
-
-    def __init__(
-        self,
-        *,
-        message_id: int,
-        starboard_message: discord.PartialMessage,
-        stars: int
-    ):
-        self.message_id = message_id
-        self.starboard_message = starboard_message
-        self.stars = stars
-
-    def __repr__(self):
-        return (
-            "<{0.__class__.__name__} stars={0.stars} "
-            "message_id={0.message_id}>".format(self)
-        )
+def active_cutoff(max_days: int) -> int:
+    """
+    Returns a snowflake for the start of a starboard's active window
 
-    async def edit(self, **kwargs):
-        await self.starboard_message.edit(**kwargs)
+    Reactions on older messages are ignored, so their stars can't change
+    """
+    return discord.utils.time_snowflake(
+        datetime.now(timezone.utc) - timedelta(days=max_days + 1))
 
 
 class Starboard:
@@ -68,7 +98,12 @@ class Starboard:
         "emoji",
         "ignored",
         "cached_stars",
-        "lock"
+        "locks",
+        "fetched",
+        "received",
+        "counts",
+        "edit_delay",
+        "pending_edits"
     )
 
     def __init__(
@@ -80,7 +115,10 @@ class Starboard:
         format: str,
         max_days: int,
         emoji: discord.PartialEmoji,
-        ignored: set[int]
+        ignored: set[int],
+        edit_delay: float = EDIT_DELAY,
+        counter_ttl: int = COUNTER_TTL,
+        counter_size: int = COUNTER_SIZE
     ):
         self.channel = channel
         self.threshold = threshold
@@ -89,66 +127,110 @@ class Starboard:
         self.emoji = emoji
         self.ignored = ignored
 
-        self.cached_stars = {}
-        self.lock = asyncio.Lock()
+        self.cached_stars = StarStore(stars)
+        # Locks are dropped once no event for their message holds or awaits them
+        self.locks: WeakValueDictionary[int, asyncio.Lock] = WeakValueDictionary()
+        self.fetched = TimedDict(decay_time=60)  # When each message was last fetched
+        self.received = TimedDict(decay_time=60)  # When each message last had an event
+        # Reaction counts of messages that haven't been starred, kept from raw events
+        self.counts = TimedDict(decay_time=counter_ttl, maxsize=counter_size)
+        self.edit_delay = edit_delay
+        self.pending_edits: dict[int, asyncio.TimerHandle] = {}
+
+    def lock_for(self, message_id: int) -> asyncio.Lock:
+        """
+        Returns the lock serializing the handling of a single message
+
+        Events for different messages are handled concurrently
+        """
+        if (lock := self.locks.get(message_id)) is None:
+            lock = self.locks[message_id] = asyncio.Lock()
+        return lock
 
-        for star in stars:
-            message = self.channel.get_partial_message(star["starboard_message_id"])
-            self.cached_stars[star["message_id"]] = Star(
-                message_id=star["message_id"],
-                starboard_message=message,
-                stars=star["stars"]
-            )
+    @property
+    def cutoff(self) -> int:
+        return active_cutoff(self.max_days)
 
-    async def create_star(self, message: discord.Message, stars: int):
-        if any([
-            message.id in self.cached_stars,
-            self.lock.locked()
-        ]):
-            return
+    def fetched_since(self, message_id: int, timestamp: float) -> bool:
+        """Returns True if the message was fetched after `timestamp`"""
+        return self.fetched.get(message_id, 0) > timestamp
 
-        async with self.lock:
-            kwargs = {"message_id": message.id, "stars": stars}
-            embed = neo.Embed(description="") \
-                .set_author(
-                    name=message.author,
-                    icon_url=message.author.display_avatar
-            )
+    async def create_star(self, message: discord.Message, stars: int) -> Optional[Star]:
+        if message.id in self.cached_stars:
+            return
 
-            if message.content:
-                embed.description = shorten(message.content, 1900) + "\n\n"
-            embed.description += f"[Jump]({message.jump_url})"
-
-            for attachment in (*message.attachments, *message.embeds):
-                if not embed.image:
-                    embed.set_image(url=attachment.url)
-                embed.add_field(
-                    name=discord.utils.escape_markdown(
-                        getattr(attachment, "filename", "Embed")),
-                    value=f"[View]({attachment.url})"
-                )
+        kwargs = {
+            "message_id": message.id,
+            "channel_id": message.channel.id,
+            "author_id": message.author.id,
+            "stars": stars
+        }
+        embed = neo.Embed(description="") \
+            .set_author(
+                name=message.author,
+                icon_url=message.author.display_avatar
+        )
 
-            kwargs["starboard_message"] = await self.channel.send(
-                self.format.format(stars=stars),
-                embed=embed
+        if message.content:
+            embed.description = shorten(message.content, 1900) + "\n\n"
+        embed.description += f"[Jump]({message.jump_url})"
+
+        for attachment in (*message.attachments, *message.embeds):
+            if not embed.image:
+                embed.set_image(url=attachment.url)
+            embed.add_field(
+                name=discord.utils.escape_markdown(
+                    getattr(attachment, "filename", "Embed")),
+                value=f"[View]({attachment.url})"
             )
-            star = Star(**kwargs)
-            self.cached_stars[message.id] = star
-            return star
 
-    async def delete_star(self, id: int):
-        star = self.cached_stars.pop(id)
+        starboard_message = await self.channel.send(
+            self.format.format(stars=stars),
+            embed=embed
+        )
+        kwargs["starboard_message_id"] = starboard_message.id
+        self.cached_stars.add(**kwargs)
+        return Star(**kwargs)
+
+    async def delete_star(self, id: int) -> Optional[Star]:
+        if (pending := self.pending_edits.pop(id, None)) is not None:
+            pending.cancel()
+        if (star := self.cached_stars.pop(id)) is None:
+            return
         try:
-            await star.starboard_message.delete()
+            await self.channel.get_partial_message(star.starboard_message_id).delete()
         finally:
             return star
 
-    async def edit_star(self, id: int, stars: int):
-        star = self.cached_stars.get(id)
-        star.stars = stars
+    def edit_star(self, id: int, stars: int):
+        """
+        Updates a star's count, and schedules an edit of its starboard message
+
+        Edits are coalesced, so that at most one edit is made per star every
+        `edit_delay` seconds. The edit always reflects the latest count.
+        """
+        self.cached_stars.set_stars(id, stars)
 
-        await star.edit(content=self.format.format(stars=star.stars))
-        return star
+        if id not in self.pending_edits:
+            loop = asyncio.get_running_loop()
+            self.pending_edits[id] = loop.call_later(
+                self.edit_delay, lambda: loop.create_task(self.flush_edit(id)))
+
+    async def flush_edit(self, id: int):
+        self.pending_edits.pop(id, None)
+        if (star := self.cached_stars.get(id)) is None:
+            return  # The star was deleted in the meantime
+        try:
+            await self.channel.get_partial_message(star.starboard_message_id).edit(
+                content=self.format.format(stars=star.stars))
+        except discord.HTTPException:
+            pass  # The starboard message may have been deleted
+
+    def flush_edits(self):
+        """Immediately performs every pending edit"""
+        for id, pending in [*self.pending_edits.items()]:
+            pending.cancel()
+            asyncio.get_event_loop().create_task(self.flush_edit(id))
 
 
 class StarboardAddon(neo.Addon, name="Starboard"):
@@ -163,27 +245,32 @@ class StarboardAddon(neo.Addon, name="Starboard"):
     def __init__(self, bot: neo.Neo):
         self.bot = bot
         self.ready = False
-        self.starboards: dict[int, Starboard] = {}
+        # Starboards are loaded on demand, least recently used first
+        self.starboards: OrderedDict[int, Starboard] = OrderedDict()
+        self.loading: dict[int, asyncio.Task] = {}
+        self.pending_writes = StarWriteBuffer()
+
+        settings = bot.cfg.get("starboard", {})
+        self.flush_pending_writes.interval = settings.get("flush_interval", FLUSH_INTERVAL)
+        self.sweep_stars.interval = settings.get("sweep_interval", SWEEP_INTERVAL)
+        self.max_cached_stars = settings.get("max_cached_stars", MAX_CACHED_STARS)
+
+        # Guilds whose starboard has been reconciled since the last (re)connect
+        self.reconciled: set[int] = set()
+        self.reconciling: dict[int, asyncio.Task] = {}
+        # Shared by every reconciliation, so catching up never competes with live traffic
+        self.reconcile_limit = asyncio.Semaphore(
+            settings.get("reconcile_concurrency", RECONCILE_CONCURRENCY))
+        self.reconcile_budget = commands.Cooldown(
+            settings.get("reconcile_burst", RECONCILE_BURST),
+            settings.get("reconcile_period", RECONCILE_PERIOD)
+        )
         bot.loop.create_task(self.__ainit__())
 
     async def __ainit__(self):
         await self.bot.wait_until_ready()
-
-        # Setup starboards
-        starboard_settings = {}
-        for record in await self.bot.db.fetch("SELECT * FROM starboards"):
-            starboard_settings[record["guild_id"]] = record
-
-        for guild_id in self.bot.configs.keys():
-            if guild_id not in [*starboard_settings.keys()]:
-                continue
-
-            settings = starboard_settings[guild_id]
-            self.starboards[guild_id] = await self.create_starboard(
-                guild_id,
-                settings
-            )
         self.ready = True
+        self.sweep_stars.start()
 
         # Initialize settings
         for col_name in SETTINGS_MAPPING.keys():
@@ -198,17 +285,114 @@ class StarboardAddon(neo.Addon, name="Starboard"):
             )
             SETTINGS_MAPPING[col_name]["description"] = col_desc
 
+        self.flush_pending_writes.start()
+        self.reconcile_loaded()
+
+    def cog_unload(self):
+        for starboard in self.starboards.values():
+            starboard.flush_edits()
+        self.flush_pending_writes.cancel()
+        self.sweep_stars.cancel()
+        for task in self.reconciling.values():
+            task.cancel()
+        self.bot.loop.create_task(self.pending_writes.flush(self.bot.db))
+
+    @periodic(FLUSH_INTERVAL)
+    async def flush_pending_writes(self):
+        await self.pending_writes.flush(self.bot.db)
+
+    @periodic(SWEEP_INTERVAL)
+    async def sweep_stars(self):
+        """
+        Drops stars that have aged out of their starboard's `max_days` from
+        memory. They're kept in the database, but can no longer change.
+        """
+        for starboard in self.starboards.values():
+            starboard.cached_stars.discard_before(starboard.cutoff)
+
+    @neo.Addon.recv("shutdown")
+    async def handle_shutdown(self):
+        self.flush_pending_writes.cancel()
+        await self.pending_writes.flush(self.bot.db)
+
+    async def get_starboard(self, guild_id: int) -> Optional[Starboard]:
+        """
+        Returns a guild's starboard, loading it if it isn't loaded already
+
+        Returns None if the guild doesn't have starboard enabled
+        """
+        if (starboard := self.starboards.get(guild_id)) is not None:
+            self.starboards.move_to_end(guild_id)
+            return starboard
+        if not getattr(self.bot.configs.get(guild_id), "starboard", False):
+            return None
+
+        # Concurrent events for an unloaded guild share a single load
+        if (task := self.loading.get(guild_id)) is None:
+            task = self.loading[guild_id] = self.bot.loop.create_task(
+                self.load_starboard(guild_id))
+            task.add_done_callback(lambda _: self.loading.pop(guild_id, None))
+        return await asyncio.shield(task)
+
+    async def load_starboard(self, guild_id: int) -> Optional[Starboard]:
+        starboard_settings = await self.bot.db.fetchrow(
+            "SELECT * FROM starboards WHERE guild_id=$1",
+            guild_id
+        )
+        if starboard_settings is None:
+            return None
+
+        starboard = await self.create_starboard(guild_id, starboard_settings)
+        self.starboards[guild_id] = starboard
+        self.evict_starboards()
+        if self.ready:
+            self.start_reconciliation(guild_id)
+        return starboard
+
+    def evict_starboards(self):
+        """
+        Unloads the least recently used starboards until the total number of
+        loaded stars is within `max_cached_stars`
+
+        Starboards that are handling events or have pending edits are kept,
+        as is the most recently used starboard
+        """
+        total = sum(len(starboard.cached_stars) for starboard in self.starboards.values())
+        for guild_id, starboard in [*self.starboards.items()][:-1]:
+            if total <= self.max_cached_stars:
+                break
+            if starboard.locks or starboard.pending_edits:
+                continue
+            del self.starboards[guild_id]
+            total -= len(starboard.cached_stars)
+
     async def create_starboard(self, guild_id, starboard_settings):
+        settings = self.bot.cfg.get("starboard", {})
+        # Only stars within the active window are loaded
+        cutoff = active_cutoff(starboard_settings["max_days"])
+        # Writes that haven't been committed yet are newer than the database
+        upserts, deletes = self.pending_writes.pending_for(guild_id)
         star_records = await self.bot.db.fetch(
             """
             SELECT
                 message_id,
+                channel_id,
+                author_id,
                 stars,
                 starboard_message_id
             FROM stars
-            WHERE guild_id=$1
-            """, guild_id
+            WHERE
+                guild_id=$1 AND
+                message_id >= $2
+            """,
+            guild_id,
+            cutoff
         )
+        star_records = [
+            *(record for record in star_records
+              if record["message_id"] not in deletes and record["message_id"] not in upserts),
+            *(row for row in upserts.values() if row["message_id"] >= cutoff)
+        ]
         kwargs = {
             "channel": self.bot.get_channel(starboard_settings["channel"]),
             "stars": star_records,
@@ -216,10 +400,159 @@ class StarboardAddon(neo.Addon, name="Starboard"):
             "format": starboard_settings["format"],
             "max_days": starboard_settings["max_days"],
             "emoji": discord.PartialEmoji.from_str(starboard_settings["emoji"]),
-            "ignored": set(starboard_settings["ignored"])
+            "ignored": set(starboard_settings["ignored"]),
+            "edit_delay": settings.get("edit_delay", EDIT_DELAY),
+            "counter_ttl": settings.get("counter_ttl", COUNTER_TTL),
+            "counter_size": settings.get("counter_size", COUNTER_SIZE)
         }
         return Starboard(**kwargs)
 
+    # Sect: Reconciliation
+
+    def start_reconciliation(self, guild_id: int):
+        """
+        Starts reconciling a loaded starboard against channel history, unless
+        it's already been reconciled since the last (re)connect
+
+        Starboards that aren't loaded are reconciled once they're next loaded,
+        so that catching up doesn't load every starboard at once
+        """
+        if guild_id in self.reconciled or guild_id in self.reconciling:
+            return
+        self.reconciled.add(guild_id)
+        task = self.reconciling[guild_id] = self.bot.loop.create_task(
+            self.reconcile_starboard(guild_id))
+        task.add_done_callback(lambda _: self.reconciling.pop(guild_id, None))
+
+    def reconcile_loaded(self):
+        for guild_id in [*self.starboards]:
+            self.start_reconciliation(guild_id)
+
+    async def reconcile_starboard(self, guild_id: int):
+        if (starboard := self.starboards.get(guild_id)) is None or starboard.channel is None:
+            self.reconciled.discard(guild_id)
+            return
+
+        guild = starboard.channel.guild
+        cutoff = starboard.cutoff
+        channels = [
+            channel for channel in guild.text_channels
+            if channel.id != starboard.channel.id
+            and channel.id not in starboard.ignored
+            and (channel.last_message_id or cutoff) >= cutoff
+            and channel.permissions_for(guild.me).read_message_history
+        ]
+        await asyncio.gather(*(
+            self.reconcile_channel(guild_id, channel) for channel in channels
+        ))
+
+    async def wait_for_budget(self):
+        while (retry_after := self.reconcile_budget.update_rate_limit()):
+            await asyncio.sleep(retry_after)
+
+    async def reconcile_channel(self, guild_id: int, channel: discord.TextChannel):
+        """
+        Walks a channel's history within the active window a page at a time,
+        applying whatever differs from the starboard
+        """
+        async with self.reconcile_limit:
+            if (starboard := self.starboards.get(guild_id)) is None:
+                self.reconciled.discard(guild_id)  # Evicted, try again once it's loaded
+                return
+            after = discord.Object(starboard.cutoff)
+            started = discord.utils.time_snowflake(datetime.now(timezone.utc))
+            seen: set[int] = set()
+
+            while True:
+                await self.wait_for_budget()
+                # Only events received before the request was made are sure to be in the page
+                fetched_at = time.monotonic()
+                try:
+                    page = [message async for message in channel.history(
+                        limit=100, after=after, oldest_first=True)]
+                except discord.HTTPException:
+                    return  # Without the full history, missing messages prove nothing
+
+                # The starboard may have been evicted or disabled in the meantime
+                if (starboard := self.starboards.get(guild_id)) is None:
+                    self.reconciled.discard(guild_id)
+                    return
+                for message in page:
+                    seen.add(message.id)
+                    await self.reconcile_message(starboard, message, fetched_at)
+
+                if len(page) < 100:
+                    break
+                after = page[-1]
+
+            # Starred messages that no longer show up were deleted
+            cutoff = starboard.cutoff
+            for message_id in starboard.cached_stars.in_channel(channel.id):
+                if message_id in seen or not cutoff <= message_id < started:
+                    continue
+                async with starboard.lock_for(message_id):
+                    if await starboard.delete_star(message_id):
+                        self.pending_writes.delete(guild_id, message_id)
+
+    async def reconcile_message(self, starboard: Starboard, message: discord.Message, fetched_at: float):
+        if message.id in starboard.ignored:
+            return
+        stars = self.star_count(starboard, message)
+        if message.id not in starboard.cached_stars and message.id not in starboard.counts \
+                and stars < starboard.threshold:
+            return  # Nothing to change
+
+        async with starboard.lock_for(message.id):
+            # Events handled after the page was fetched have already moved past it
+            if starboard.received.get(message.id, 0) > fetched_at:
+                return
+            starboard.fetched[message.id] = fetched_at
+            star = starboard.cached_stars.get(message.id)
+
+            if star is not None:
+                if stars < starboard.threshold:
+                    await starboard.delete_star(star.message_id)
+                    self.pending_writes.delete(message.guild.id, star.message_id)
+                    starboard.counts[star.message_id] = stars
+                elif stars != star.stars:
+                    starboard.edit_star(star.message_id, stars)
+                    self.pending_writes.upsert(
+                        message.guild.id,
+                        star.message_id,
+                        star.channel_id,
+                        star.author_id,
+                        stars,
+                        star.starboard_message_id
+                    )
+                return
+
+            if stars < starboard.threshold:
+                starboard.counts[message.id] = stars
+                return
+
+            star = await starboard.create_star(message, stars)
+            if not star:
+                return
+            starboard.counts.pop(message.id, None)
+            self.pending_writes.upsert(
+                message.guild.id,
+                message.id,
+                message.channel.id,
+                message.author.id,
+                stars,
+                star.starboard_message_id
+            )
+
+    @commands.Cog.listener("on_ready")
+    @commands.Cog.listener("on_resumed")
+    async def handle_reconnect(self):
+        # Events may have been missed by every starboard, loaded or not
+        self.reconciled.clear()
+        # The first ready is handled by __ainit__
+        if self.ready:
+            self.reconcile_loaded()
+
+    # /Sect: Reconciliation
     # Sect: Event handling
 
     # Takes advantage of the better ratelimits of the history endpoint
@@ -252,130 +585,165 @@ class StarboardAddon(neo.Addon, name="Starboard"):
             emoji = discord.PartialEmoji.from_str(emoji)
         return emoji == starboard.emoji
 
+    def star_count(self, starboard: Starboard, message: discord.Message) -> int:
+        return getattr(
+            next(filter(
+                lambda r: self.reaction_check(starboard, r.emoji),
+                message.reactions
+            ), None),
+            "count",
+            0
+        )
+
     @commands.Cog.listener("on_raw_reaction_add")
     @commands.Cog.listener("on_raw_reaction_remove")
     async def handle_individual_reaction(self, payload: discord.RawReactionActionEvent):
-        starboard: Starboard = self.starboards.get(payload.guild_id)
+        received = time.monotonic()
+        starboard = await self.get_starboard(payload.guild_id)
 
         if not self.predicate(starboard, payload):
             return
+        starboard.received[payload.message_id] = received
 
-        star = starboard.cached_stars.get(payload.message_id)
-        if star is None:
-            message = await self.fetch_message(
-                self.bot.get_channel(payload.channel_id),
-                payload.message_id
-            )
-            reaction_count = getattr(
-                next(filter(
-                    lambda r: self.reaction_check(starboard, r.emoji),
-                    message.reactions
-                ), None),
-                "count",
-                0
-            )
-            if reaction_count < starboard.threshold:
+        async with starboard.lock_for(payload.message_id):
+            # Events that raced with a fetch of the message are already counted by it
+            if starboard.fetched_since(payload.message_id, received):
                 return
+            await self.process_reaction(starboard, payload)
 
-            star = await starboard.create_star(message, reaction_count)
-            if not star:
-                return
+    async def process_reaction(self, starboard: Starboard, payload: discord.RawReactionActionEvent):
+        if not self.reaction_check(starboard, payload.emoji):
+            return
+        # Eventually replace this with a patma
+        delta = 1 if payload.event_type == "REACTION_ADD" else -1
 
-            await self.bot.db.execute(
-                """
-                INSERT INTO stars (
-                    guild_id,
-                    message_id,
-                    channel_id,
+        star = starboard.cached_stars.get(payload.message_id)
+        if star is not None:
+            stars = star.stars + delta
+
+            if stars < starboard.threshold:
+                await starboard.delete_star(star.message_id)
+                self.pending_writes.delete(payload.guild_id, star.message_id)
+                # Keep counting, so crossing the threshold again doesn't need a fetch
+                starboard.counts[star.message_id] = stars
+            else:
+                starboard.edit_star(star.message_id, stars)
+                self.pending_writes.upsert(
+                    payload.guild_id,
+                    star.message_id,
+                    star.channel_id,
+                    star.author_id,
                     stars,
-                    starboard_message_id
-                ) VALUES (
-                    $1, $2, $3, $4, $5
+                    star.starboard_message_id
                 )
-                """,
-                message.guild.id,
-                message.id,
-                message.channel.id,
-                reaction_count,
-                star.starboard_message.id
-            )
+            return
 
+        if (count := starboard.counts.get(payload.message_id)) is None:
+            if delta < 0:
+                return  # Unseen messages are only seeded once they're reacted to
         else:
-            if not self.reaction_check(starboard, payload.emoji):
+            starboard.counts[payload.message_id] = count = count + delta
+            if count < starboard.threshold:
                 return
 
-            # Eventually replace this with a patma
-            if payload.event_type == "REACTION_ADD":
-                star.stars += 1
-            else:
-                star.stars -= 1
+        # Either seeds the count, or reconciles it before the message is starred.
+        # Only events received before the request was made are sure to be counted by it
+        requested = time.monotonic()
+        message = await self.fetch_message(
+            self.bot.get_channel(payload.channel_id),
+            payload.message_id
+        )
+        if message.id != payload.message_id:
+            return  # The message has been deleted
+        starboard.fetched[message.id] = requested
+        reaction_count = self.star_count(starboard, message)
+        starboard.counts[message.id] = reaction_count
+        if reaction_count < starboard.threshold:
+            return
 
-            if star.stars < starboard.threshold:
-                await starboard.delete_star(star.message_id)
-                await self.bot.db.execute(
-                    "DELETE FROM stars WHERE message_id=$1",
-                    star.message_id
-                )
-            else:
-                await starboard.edit_star(star.message_id, star.stars)
-                await self.bot.db.execute(
-                    """
-                    UPDATE stars
-                    SET stars=$1
-                    WHERE message_id=$2
-                    """,
-                    star.stars,
-                    star.message_id
-                )
+        star = await starboard.create_star(message, reaction_count)
+        if not star:
+            return
+        starboard.counts.pop(message.id, None)  # The star tracks the count from here
+
+        self.pending_writes.upsert(
+            message.guild.id,
+            message.id,
+            message.channel.id,
+            message.author.id,
+            reaction_count,
+            star.starboard_message_id
+        )
 
     @commands.Cog.listener("on_raw_reaction_clear")
     @commands.Cog.listener("on_raw_reaction_clear_emoji")
     @commands.Cog.listener("on_raw_message_delete")
     async def handle_terminations(self, payload):
-        starboard: Starboard = self.starboards.get(payload.guild_id)
+        starboard = await self.get_starboard(payload.guild_id)
 
         if not self.predicate(starboard, payload):
             return
 
         if isinstance(payload, discord.RawReactionClearEmojiEvent):
-            if not self.reaction_check(payload.emoji):
+            if not self.reaction_check(starboard, payload.emoji):
                 return
 
-        star = starboard.cached_stars.get(payload.message_id)
-        if not star:
-            return
+        async with starboard.lock_for(payload.message_id):
+            starboard.counts.pop(payload.message_id, None)
+            star = starboard.cached_stars.get(payload.message_id)
+            if not star:
+                return
 
-        await starboard.delete_star(star.message_id)
-        await self.bot.db.execute(
-            "DELETE FROM stars WHERE message_id=$1",
-            star.message_id
-        )
+            await starboard.delete_star(star.message_id)
+            self.pending_writes.delete(payload.guild_id, star.message_id)
 
     @neo.Addon.recv("config_update")
     async def handle_starboard_setting(self, guild, settings):
         if settings.starboard is True:
-            if guild.id in self.starboards:
-                return
-
-            # Create a new starboard if one doesn't exist
-            starboard_data = await self.bot.db.fetchrow(
+            # Create a new starboard if one doesn't exist, it'll be loaded once it's used
+            await self.bot.db.execute(
                 """
                 INSERT INTO starboards (
                     guild_id
                 ) VALUES ($1)
-                RETURNING *
+                ON CONFLICT (guild_id) DO NOTHING
                 """,
                 guild.id
             )
 
-            self.starboards[guild.id] = await self.create_starboard(
-                guild.id,
-                starboard_data
-            )
-
     @neo.Addon.recv("config_delete")
     async def handle_deleted_config(self, guild_id: int):
         self.starboards.pop(guild_id, None)
+        self.pending_writes.discard_guild(guild_id)
+
+    async def delete_uncached_star(self, starboard: Starboard, guild_id: int, message_id: int):
+        """Deletes a star that's outside of the active window, and so isn't in memory"""
+        upserts, deletes = self.pending_writes.pending_for(guild_id)
+        if message_id in deletes:
+            return
+        if message_id in upserts:
+            starboard_message_id = upserts[message_id]["starboard_message_id"]
+        else:
+            starboard_message_id = await self.bot.db.fetchval(
+                """
+                SELECT starboard_message_id
+                FROM stars
+                WHERE
+                    guild_id=$1 AND
+                    message_id=$2
+                """,
+                guild_id,
+                message_id
+            )
+            if starboard_message_id is None:
+                return
+
+        self.pending_writes.delete(guild_id, message_id)
+        if starboard.channel is not None:
+            try:
+                await starboard.channel.get_partial_message(starboard_message_id).delete()
+            except discord.HTTPException:
+                pass  # The starboard message may have been deleted
 
     # /Sect: Event Handling
     # Sect: Commands
@@ -391,11 +759,88 @@ class StarboardAddon(neo.Addon, name="Starboard"):
             ))
         return True
 
+    def format_leaderboard_entry(self, guild_id: int, board: str, record) -> str:
+        if board == "messages":
+            url = f"https://discord.com/channels/{guild_id}/{record['channel_id']}/{record['message_id']}"
+            return f"**{record['stars']}** ⭐ [Jump]({url}) in <#{record['channel_id']}>"
+
+        target = f"<@{record['author_id']}>" if board == "authors" else f"<#{record['channel_id']}>"
+        return f"**{record['stars']}** ⭐ {target} ({record['messages']} starred messages)"
+
+    async def fetch_leaderboard(self, guild_id: int, board: str, limit: int = LEADERBOARD_SIZE):
+        # Make sure buffered writes are reflected in the totals
+        await self.pending_writes.flush(self.bot.db)
+        return await self.bot.db.fetch(LEADERBOARD_QUERIES[board], guild_id, limit)
+
     @commands.group()
-    @commands.has_permissions(manage_channels=True)
     async def starboard(self, ctx):
         """Group command for managing starboards"""
 
+    @starboard.command(name="top")
+    async def starboard_top(self, ctx, board: str = "messages"):
+        """
+        Displays the server's starboard leaderboard
+
+        `board` may be one of `messages`, `authors` or `channels`
+        """
+        board = board.lower()
+        if board not in LEADERBOARD_QUERIES:
+            raise commands.BadArgument(
+                f"Leaderboard must be one of {', '.join(map('`{}`'.format, LEADERBOARD_QUERIES))}"
+            )
+
+        records = await self.fetch_leaderboard(ctx.guild.id, board)
+        formatted = [
+            f"`{index}.` " + self.format_leaderboard_entry(ctx.guild.id, board, record)
+            for index, record in enumerate(records, 1)
+        ]
+
+        menu = ButtonsMenu.from_iterable(
+            formatted or ["Nothing has been starred yet"],
+            per_page=10,
+            use_embed=True,
+            template_embed=neo.Embed().set_author(
+                name=f"Top starred {board} in {ctx.guild}",
+                icon_url=ctx.guild.icon
+            )
+        )
+        await menu.start(ctx)
+
+    @starboard.command(name="stats")
+    async def starboard_stats(self, ctx):
+        """Displays an overview of the server's starboard activity"""
+        await self.pending_writes.flush(self.bot.db)
+        totals = await self.bot.db.fetchrow(
+            """
+            SELECT
+                COALESCE(SUM(stars), 0) AS stars,
+                COALESCE(SUM(messages), 0) AS messages
+            FROM star_channels
+            WHERE guild_id=$1
+            """,
+            ctx.guild.id
+        )  # Bounded by the number of channels, not the number of stars
+
+        embed = neo.Embed(
+            description=f"**{totals['stars']}** stars across "
+            f"**{totals['messages']}** starred messages"
+        ).set_author(
+            name=f"Starboard stats for {ctx.guild}",
+            icon_url=ctx.guild.icon
+        )
+        for board in LEADERBOARD_QUERIES:
+            records = await self.bot.db.fetch(LEADERBOARD_QUERIES[board], ctx.guild.id, 3)
+            embed.add_field(
+                name=f"Top {board}",
+                value="\n".join(
+                    self.format_leaderboard_entry(ctx.guild.id, board, record)
+                    for record in records
+                ) or "Nothing has been starred yet",
+                inline=False
+            )
+
+        await ctx.send(embed=embed)
+
     @starboard.command(name="list")
     @commands.has_permissions(manage_channels=True)
     async def starboard_list(self, ctx):
@@ -404,7 +849,7 @@ class StarboardAddon(neo.Addon, name="Starboard"):
 
         Descriptions of the settings are also provided here
         """
-        starboard = self.starboards[ctx.guild.id]
+        starboard = await self.get_starboard(ctx.guild.id)
         embeds = []
 
         for setting, setting_info in SETTINGS_MAPPING.items():
@@ -431,7 +876,7 @@ class StarboardAddon(neo.Addon, name="Starboard"):
         More information on the available settings and their functions is in the `starboard` command
         """
         value = await convert_setting(ctx, SETTINGS_MAPPING, setting, new_value)
-        starboard = self.starboards[ctx.guild.id]
+        starboard = await self.get_starboard(ctx.guild.id)
         setattr(starboard, setting, value)
 
         if setting == "emoji":
@@ -450,13 +895,20 @@ class StarboardAddon(neo.Addon, name="Starboard"):
         # ^ Using string formatting in SQL is safe here because
         # the setting is thoroughly validated
         if setting in ["channel", "emoji"]:
+            self.pending_writes.discard_guild(ctx.guild.id)
             await self.bot.db.execute("DELETE FROM stars WHERE guild_id=$1", ctx.guild.id)
             starboard.cached_stars.clear()
+            starboard.counts.clear()
+        elif setting == "max_days":
+            # A wider window includes stars that aren't loaded, so load them
+            starboard.flush_edits()
+            self.starboards.pop(ctx.guild.id, None)
+            self.reconciled.discard(ctx.guild.id)
 
         await ctx.send(f"Setting `{setting}` has been changed!")
 
     @starboard.command(name="ignore")
-    @commands.has_permissions(manage_messages=True)
+    @commands.has_permissions(manage_channels=True, manage_messages=True)
     async def starboard_ignore(self, ctx, to_ignore: Union[discord.TextChannel, discord.PartialMessage]):
         """
         Ignores a channel or message
@@ -467,7 +919,7 @@ class StarboardAddon(neo.Addon, name="Starboard"):
         Note: If an already starred message is ignored, the
         star will be deleted, *and* the message will be ignored
         """
-        starboard = self.starboards[ctx.guild.id]
+        starboard = await self.get_starboard(ctx.guild.id)
         id = to_ignore.id
 
         starboard.ignored.add(id)
@@ -483,21 +935,20 @@ class StarboardAddon(neo.Addon, name="Starboard"):
             ctx.guild.id
         )
 
-        if isinstance(to_ignore, discord.PartialMessage) \
-                and starboard.cached_stars.get(id):
-            await starboard.delete_star(id)
-            await self.bot.db.execute(
-                "DELETE FROM stars WHERE message_id=$1",
-                id
-            )
+        if isinstance(to_ignore, discord.PartialMessage):
+            if starboard.cached_stars.get(id):
+                await starboard.delete_star(id)
+                self.pending_writes.delete(ctx.guild.id, id)
+            else:
+                await self.delete_uncached_star(starboard, ctx.guild.id, id)
 
         await ctx.send("Successfully ignored the provided entity!")
 
     @starboard.command(name="unignore")
-    @commands.has_permissions(manage_messages=True)
+    @commands.has_permissions(manage_channels=True, manage_messages=True)
     async def starboard_unignore(self, ctx, to_ignore: Union[discord.TextChannel, discord.PartialMessage, int]):
         """Unignores a channel or message"""
-        starboard = self.starboards[ctx.guild.id]
+        starboard = await self.get_starboard(ctx.guild.id)
         id = getattr(to_ignore, "id", to_ignore)
 
         starboard.ignored.remove(id)
@@ -516,10 +967,10 @@ class StarboardAddon(neo.Addon, name="Starboard"):
         await ctx.send("Successfully unignored the provided entity!")
 
     @starboard.command(name="ignored")
-    @commands.has_permissions(manage_messages=True)
+    @commands.has_permissions(manage_channels=True, manage_messages=True)
     async def starboard_ignored(self, ctx):
         """Displays a list of all ignored items"""
-        starboard = self.starboards[ctx.guild.id]
+        starboard = await self.get_starboard(ctx.guild.id)
 
         formatted: list[str] = []
         for id in starboard.ignored:
@@ -1,11 +1,14 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2021 nickofolas
 import asyncio
-import contextlib
+import time
 import zoneinfo
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from collections.abc import MutableMapping, MutableSet
 from functools import cache
-from typing import Optional
+from itertools import chain
+from typing import Any, Optional
 
 
 def add_hook(attr_name: str):
@@ -180,32 +183,136 @@ class NeoGuildConfig(RecordContainer):
         super().__setattr__(attribute, value)
 
 
-class TimedSet(set):
+class TimedDict(MutableMapping):
+    """
+    A mapping whose entries expire `decay_time` seconds after they were last set
+
+    Since every entry shares the same decay time, insertion order is also
+    expiry order. Entries are kept in an `OrderedDict`, so refreshing an entry
+    is O(1), and a single reaper task expires entries from the front.
+    The reaper only runs while the mapping is non-empty.
+
+    If `maxsize` is given, the entries closest to expiry are evicted early
+    to keep the mapping within it.
+    """
+
     def __init__(
         self,
         *args,
         decay_time: int = 60,
+        maxsize: Optional[int] = None,
         loop: asyncio.AbstractEventLoop = None,
         **kwargs
     ):
-        super().__init__(*args, **kwargs)
-        self.decay_time = decay_time
+        self._decay_time = decay_time
+        self.maxsize = maxsize
+        self._data: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._reaper: Optional[asyncio.Task] = None
         self.loop = loop or asyncio.get_event_loop()
-        self.running = {}
+        self.update(*args, **kwargs)
 
-        for item in self:
+    def __repr__(self):
+        return "<{0.__class__.__name__} decay_time={0.decay_time} size={1}>".format(
+            self, len(self))
+
+    @property
+    def decay_time(self) -> int:
+        return self._decay_time
+
+    @decay_time.setter
+    def decay_time(self, value: int):
+        self._decay_time = value
+        if self._reaper is not None:  # Have the reaper pick up the new deadline
+            self._reaper.cancel()
+            self._reaper = self.loop.create_task(self._reap())
+
+    def __getitem__(self, key):
+        touched, value = self._data[key]
+        if touched + self._decay_time <= time.monotonic():
+            del self._data[key]
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        if self._reaper is None:
+            self._reaper = self.loop.create_task(self._reap())
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def __iter__(self):
+        self.prune()
+        return iter([*self._data])
+
+    def __len__(self):
+        self.prune()
+        return len(self._data)
+
+    def prune(self):
+        """Removes all expired entries"""
+        deadline = time.monotonic() - self._decay_time
+        while self._data:
+            key, (touched, _) = next(iter(self._data.items()))
+            if touched > deadline:
+                break
+            del self._data[key]
+
+    async def _reap(self):
+        try:
+            while self._data:
+                touched, _ = next(iter(self._data.values()))
+                await asyncio.sleep(max(touched + self._decay_time - time.monotonic(), 0))
+                self.prune()
+        finally:
+            if self._reaper is asyncio.current_task():
+                self._reaper = None
+
+
+class TimedSet(MutableSet):
+    """
+    A set whose items expire `decay_time` seconds after they were last added
+
+    Backed by a `TimedDict`, so re-adding an item to refresh it is O(1)
+    """
+
+    def __init__(
+        self,
+        *args,
+        decay_time: int = 60,
+        maxsize: Optional[int] = None,
+        loop: asyncio.AbstractEventLoop = None
+    ):
+        self._items = TimedDict(decay_time=decay_time, maxsize=maxsize, loop=loop)
+        for item in chain.from_iterable(args):
             self.add(item)
 
+    def __repr__(self):
+        return "<{0.__class__.__name__} decay_time={0.decay_time} size={1}>".format(
+            self, len(self))
+
+    @property
+    def decay_time(self) -> int:
+        return self._items.decay_time
+
+    @decay_time.setter
+    def decay_time(self, value: int):
+        self._items.decay_time = value
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
     def add(self, item):
-        with contextlib.suppress(KeyError):
-            con = self.running.pop(item)
-            con.cancel()
-
-        super().add(item)
-        task = self.loop.create_task(self.decay(item))
-        self.running[item] = task
-
-    async def decay(self, item):
-        await asyncio.sleep(self.decay_time)
-        self.discard(item)
-        self.running.pop(item, None)
+        self._items[item] = None
+
+    def discard(self, item):
+        self._items.pop(item, None)
@@ -1,14 +1,31 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2021 nickofolas
-from discord import Object, User, abc
+from typing import Callable, Optional
+
+from discord import ChannelType, Object, PartialMessageable, User, abc
 
 
 class PartialUser(abc.Messageable, Object):
-    """Represents a "partial" Discord user"""
+    """
+    Represents a "partial" Discord user
+
+    If the ID of the user's DM channel is known, messages are sent to it
+    directly, rather than opening the DM channel first. Otherwise, the
+    channel is opened, and its ID is passed to `on_create_dm`.
+    """
 
-    def __init__(self, *, state, id):
+    def __init__(
+        self,
+        *,
+        state,
+        id,
+        dm_channel_id: Optional[int] = None,
+        on_create_dm: Optional[Callable[[int, int], None]] = None
+    ):
         self._state = state
         self.id = id
+        self.dm_channel_id = dm_channel_id
+        self.on_create_dm = on_create_dm
 
     def __repr__(self):
         return "<{0.__class__.__name__} id={0.id}>".format(self)
@@ -22,6 +39,18 @@ class PartialUser(abc.Messageable, Object):
         data = await self._state.http.get_user(self.id)
         return User(state=self._state, data=data)
 
-    _get_channel = User._get_channel
+    async def _get_channel(self):
+        if (channel := self.dm_channel) is not None:
+            return channel
+        if self.dm_channel_id is not None:
+            return PartialMessageable(
+                state=self._state, id=self.dm_channel_id, type=ChannelType.private)
+
+        channel = await self.create_dm()
+        self.dm_channel_id = channel.id
+        if self.on_create_dm is not None:
+            self.on_create_dm(self.id, channel.id)
+        return channel
+
     dm_channel = User.dm_channel
     create_dm = User.create_dm
@@ -24,6 +24,7 @@ class PeriodicTimer:
         self.interval = interval
         self.instance = None
         self.is_stopped = False
+        self.task = None
         self.logger = logging.getLogger(callback.__module__)
 
     def __get__(self, instance: Optional[object], owner):
@@ -37,11 +38,11 @@ class PeriodicTimer:
         self.task = asyncio.create_task(self.runner())
 
     def shutdown(self):
-        if not self.task.done():
+        if self.task and not self.task.done():
             self.is_stopped = True
 
     def cancel(self):
-        if not self.task.done():
+        if self.task and not self.task.done():
             self.task.cancel()
 
     async def runner(self):
@@ -52,6 +53,8 @@ class PeriodicTimer:
                     await self.callback(self.instance)
                 else:
                     await self.callback()
+            except asyncio.CancelledError:
+                raise  # Let cancel() stop the timer even while the callback is running
             except BaseException as e:
                 self.logger.error(format_exception(e))
             if self.is_stopped:
@@ -28,4 +28,50 @@ BEGIN
         cols.column_name   = _column_name;
     RETURN result;
 END;
-$$ LANGUAGE plpgsql;
\ No newline at end of file
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION update_star_aggregates()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE star_channels SET
+            stars    = stars - OLD.stars,
+            messages = messages - 1
+        WHERE guild_id = OLD.guild_id AND channel_id = OLD.channel_id;
+        DELETE FROM star_channels
+        WHERE guild_id = OLD.guild_id AND channel_id = OLD.channel_id AND messages <= 0;
+
+        IF OLD.author_id IS NOT NULL THEN
+            UPDATE star_authors SET
+                stars    = stars - OLD.stars,
+                messages = messages - 1
+            WHERE guild_id = OLD.guild_id AND author_id = OLD.author_id;
+            DELETE FROM star_authors
+            WHERE guild_id = OLD.guild_id AND author_id = OLD.author_id AND messages <= 0;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO star_channels (guild_id, channel_id, stars, messages)
+        VALUES (NEW.guild_id, NEW.channel_id, NEW.stars, 1)
+        ON CONFLICT (guild_id, channel_id) DO UPDATE SET
+            stars    = star_channels.stars + EXCLUDED.stars,
+            messages = star_channels.messages + 1;
+
+        IF NEW.author_id IS NOT NULL THEN
+            INSERT INTO star_authors (guild_id, author_id, stars, messages)
+            VALUES (NEW.guild_id, NEW.author_id, NEW.stars, 1)
+            ON CONFLICT (guild_id, author_id) DO UPDATE SET
+                stars    = star_authors.stars + EXCLUDED.stars,
+                messages = star_authors.messages + 1;
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS update_star_aggregates ON stars;
+CREATE TRIGGER update_star_aggregates
+AFTER INSERT OR UPDATE OR DELETE ON stars
+FOR EACH ROW EXECUTE PROCEDURE update_star_aggregates();
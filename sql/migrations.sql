@@ -0,0 +1,72 @@
+-- SPDX-License-Identifier: AGPL-3.0-or-later
+-- Copyright (C) 2021 nickofolas
+-- Brings databases created from an older schema.sql up to date. Every
+-- migration is safe to re-run. Apply with the bot stopped, before
+-- functions.sql, since its functions rely on these changes.
+
+-- Cached DM channel IDs, so DMs don't need to open a channel first
+CREATE TABLE IF NOT EXISTS dm_channels (
+    user_id    BIGINT PRIMARY KEY,
+    channel_id BIGINT NOT NULL
+);
+
+-- Starboard leaderboards: adds stars.author_id and the aggregate tables to
+-- databases created before them, then rebuilds the aggregates from stars
+BEGIN;
+
+ALTER TABLE stars ADD COLUMN IF NOT EXISTS author_id BIGINT;
+CREATE INDEX IF NOT EXISTS stars_leaderboard_idx ON stars (guild_id, stars DESC);
+
+CREATE TABLE IF NOT EXISTS star_authors (
+    guild_id  BIGINT NOT NULL,
+    author_id BIGINT NOT NULL,
+    stars     BIGINT NOT NULL DEFAULT 0,
+    messages  BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, author_id),
+    FOREIGN KEY (guild_id) REFERENCES starboards (guild_id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS star_authors_leaderboard_idx ON star_authors (guild_id, stars DESC);
+
+CREATE TABLE IF NOT EXISTS star_channels (
+    guild_id   BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    stars      BIGINT NOT NULL DEFAULT 0,
+    messages   BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, channel_id),
+    FOREIGN KEY (guild_id) REFERENCES starboards (guild_id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS star_channels_leaderboard_idx ON star_channels (guild_id, stars DESC);
+
+-- Keep stars from changing while the totals are rebuilt
+LOCK TABLE stars IN SHARE MODE;
+
+-- Stars recorded before authors were stored have no author, and are only
+-- counted towards their channel
+INSERT INTO star_channels (guild_id, channel_id, stars, messages)
+SELECT guild_id, channel_id, SUM(stars), COUNT(*)
+FROM stars
+GROUP BY guild_id, channel_id
+ON CONFLICT (guild_id, channel_id) DO UPDATE SET
+    stars    = EXCLUDED.stars,
+    messages = EXCLUDED.messages;
+DELETE FROM star_channels totals
+WHERE NOT EXISTS (
+    SELECT 1 FROM stars
+    WHERE stars.guild_id = totals.guild_id AND stars.channel_id = totals.channel_id
+);
+
+INSERT INTO star_authors (guild_id, author_id, stars, messages)
+SELECT guild_id, author_id, SUM(stars), COUNT(*)
+FROM stars
+WHERE author_id IS NOT NULL
+GROUP BY guild_id, author_id
+ON CONFLICT (guild_id, author_id) DO UPDATE SET
+    stars    = EXCLUDED.stars,
+    messages = EXCLUDED.messages;
+DELETE FROM star_authors totals
+WHERE NOT EXISTS (
+    SELECT 1 FROM stars
+    WHERE stars.guild_id = totals.guild_id AND stars.author_id = totals.author_id
+);
+
+COMMIT;
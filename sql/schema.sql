@@ -50,12 +50,44 @@ CREATE TABLE stars (
     guild_id             BIGINT NOT NULL,
     message_id           BIGINT NOT NULL,
     channel_id           BIGINT NOT NULL,
+    author_id            BIGINT,
     stars                BIGINT NOT NULL,
     starboard_message_id BIGINT NOT NULL,
     PRIMARY KEY (guild_id, message_id, channel_id),
     FOREIGN KEY (guild_id) REFERENCES starboards (guild_id) ON DELETE CASCADE
 );
 
+CREATE INDEX stars_leaderboard_idx ON stars (guild_id, stars DESC);
+
+-- Running totals for the starboard leaderboards, maintained by the
+-- update_star_aggregates trigger so that they never need to scan stars
+CREATE TABLE star_authors (
+    guild_id  BIGINT NOT NULL,
+    author_id BIGINT NOT NULL,
+    stars     BIGINT NOT NULL DEFAULT 0,
+    messages  BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, author_id),
+    FOREIGN KEY (guild_id) REFERENCES starboards (guild_id) ON DELETE CASCADE
+);
+
+CREATE INDEX star_authors_leaderboard_idx ON star_authors (guild_id, stars DESC);
+
+CREATE TABLE star_channels (
+    guild_id   BIGINT NOT NULL,
+    channel_id BIGINT NOT NULL,
+    stars      BIGINT NOT NULL DEFAULT 0,
+    messages   BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, channel_id),
+    FOREIGN KEY (guild_id) REFERENCES starboards (guild_id) ON DELETE CASCADE
+);
+
+CREATE INDEX star_channels_leaderboard_idx ON star_channels (guild_id, stars DESC);
+
+CREATE TABLE dm_channels (
+    user_id    BIGINT PRIMARY KEY,
+    channel_id BIGINT NOT NULL
+);
+
 CREATE TABLE reminders (
     user_id    BIGINT NOT NULL,
     message_id BIGINT NOT NULL,